@@ -0,0 +1,199 @@
+"""
+Downcasting of DataFrame columns to the smallest dtypes that hold their values
+
+Integers get the smallest integer type of their range. Floats are kept as float32 (float64 if
+out of range) unless a precision hint gives the number of decimals a column needs: hinted
+columns are rounded to those decimals and get the smallest float type whose spacing at the
+largest value is at most half a step of those decimals (float16 only for small values, e.g.
+below 8 with 2 decimals). Datetimes stay datetime64, text becomes category.
+
+The inferred schema of a dataset (dtypes with the ranges seen) can be cached in a JSON file,
+so later data of the same dataset (e.g. the next month) is cast without inferring it again.
+Only columns that can outgrow their cached dtype (integers, float16 and floats with decimals)
+are checked and widened.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+INTEGER_TYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32, np.int64, np.uint64]
+
+FLOAT_TYPES = [np.float16, np.float32, np.float64]
+
+
+def column_ranges(df, columns):
+    """
+    Returns the min and max of columns (a DataFrame indexed by min and max), computed for all columns at once
+    """
+    if len(columns) == 0:
+        return pd.DataFrame(index=['min', 'max'])
+    return df[columns].agg(['min', 'max'])
+
+
+def integer_dtype(c_min, c_max):
+    """
+    Smallest integer type that holds values between c_min and c_max
+    """
+    for int_type in INTEGER_TYPES:
+        if c_min >= np.iinfo(int_type).min and c_max <= np.iinfo(int_type).max:
+            return np.dtype(int_type).name
+    return 'float64'
+
+
+def float_dtype(c_min, c_max, decimals=None):
+    """
+    Smallest float type that holds values between c_min and c_max (float32 without decimals)
+    or resolves them to decimals
+    """
+    max_abs = max(abs(c_min), abs(c_max))
+    if decimals is None:
+        return 'float32' if max_abs < float(np.finfo(np.float32).max) else 'float64'
+    # floats are spaced by powers of two, widest at the largest value (inf, so never chosen, if out of range)
+    for float_type in FLOAT_TYPES:
+        with np.errstate(over='ignore', invalid='ignore'):
+            spacing = np.spacing(float_type(max_abs))
+        if spacing <= 10.0**-decimals / 2:
+            return np.dtype(float_type).name
+    return 'float64'
+
+
+def column_dtype(dtype, c_min, c_max, decimals=None):
+    """
+    Downcast dtype of a column with values between c_min and c_max
+    """
+    if pd.isna(c_min) or pd.isna(c_max):
+        return dtype.name
+    if pd.api.types.is_integer_dtype(dtype):
+        return integer_dtype(c_min, c_max)
+    return float_dtype(c_min, c_max, decimals)
+
+
+def is_numeric(dtype):
+    return isinstance(dtype, np.dtype) and (np.issubdtype(dtype, np.integer) or np.issubdtype(dtype, np.floating))
+
+
+def infer_schema(df, precision=None):
+    """
+    Returns the downcast dtype, range and decimals of every column
+
+    :param df: DataFrame to downcast
+    :param precision: dictionary of the decimals to keep in float columns, e.g. {'revenue' : 2}
+    """
+    precision = precision or {}
+    numeric = [col for col in df.columns if is_numeric(df[col].dtype)]
+    ranges = column_ranges(df, numeric)
+
+    schema = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if col in numeric:
+            c_min, c_max = ranges[col]['min'], ranges[col]['max']
+            decimals = precision.get(col) if np.issubdtype(dtype, np.floating) else None
+            schema[col] = {'dtype' : column_dtype(dtype, c_min, c_max, decimals), 'decimals' : decimals,
+                           'min' : None if pd.isna(c_min) else c_min.item(),
+                           'max' : None if pd.isna(c_max) else c_max.item()}
+        elif dtype == object or isinstance(dtype, pd.StringDtype):
+            schema[col] = {'dtype' : 'category'}
+        else:
+            # datetimes, categories and booleans are kept
+            schema[col] = {'dtype' : dtype.name}
+    return schema
+
+
+def widen_schema(df, schema):
+    """
+    Widens the cached dtypes of integer, float16 and float columns with decimals whose values in df are out
+    of the cached range
+    Returns the schema and whether it changed
+    """
+    columns = [col for col, column_schema in schema.items() if is_numeric(df[col].dtype)
+               and (column_schema['dtype'].startswith(('int', 'uint', 'float16'))
+                    or column_schema.get('decimals') is not None)]
+    ranges = column_ranges(df, columns)
+
+    changed = False
+    for col in columns:
+        column_schema = schema[col]
+        if pd.isna(ranges[col]['min']):
+            continue
+        c_min, c_max = ranges[col]['min'].item(), ranges[col]['max'].item()
+        if column_schema['min'] is not None:
+            if column_schema['min'] <= c_min and c_max <= column_schema['max']:
+                continue
+            c_min, c_max = min(c_min, column_schema['min']), max(c_max, column_schema['max'])
+        dtype = column_dtype(df[col].dtype, c_min, c_max, column_schema['decimals'])
+        schema[col] = dict(column_schema, dtype=dtype, min=c_min, max=c_max)
+        changed = True
+    return schema, changed
+
+
+def load_schema_cache(cache_path):
+    if cache_path is None or not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def save_schema_cache(cache_path, cache):
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+
+def apply_schema(df, schema):
+    """
+    Casts the columns of df to the schema (float columns with decimals are rounded first)
+    """
+    columns = {}
+    for col, column_schema in schema.items():
+        values = df[col]
+        if column_schema.get('decimals') is not None:
+            values = values.round(column_schema['decimals'])
+        columns[col] = values.astype(column_schema['dtype']) if values.dtype.name != column_schema['dtype'] else values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def memory_report(before, after):
+    """
+    Memory (MB) of every column before and after downcasting
+    """
+    report = pd.DataFrame({'dtype_before' : before.dtypes.astype(str), 'dtype_after' : after.dtypes.astype(str),
+                           'memory_before_mb' : before.memory_usage(index=False, deep=True) / 1024**2,
+                           'memory_after_mb' : after.memory_usage(index=False, deep=True) / 1024**2})
+    report['saved_mb'] = report['memory_before_mb'] - report['memory_after_mb']
+    return report
+
+
+def reduce_memory(df, dataset=None, precision=None, cache_path=None, refresh=False, verbose=True):
+    """
+    Downcasts the columns of df and prints the memory saved
+
+    :param df: DataFrame to downcast
+    :param dataset: name of the dataset of df in the schema cache
+    :param precision: dictionary of the decimals to keep in float columns, e.g. {'revenue' : 2}
+    (applies when the schema is inferred, cached schemas keep their decimals)
+    :param cache_path: JSON file of the schema cache (schemas aren't cached if None)
+    :param refresh: infer the schema again, even if it is cached
+    """
+    cache = load_schema_cache(cache_path)
+    schema = cache.get(dataset) if dataset is not None and not refresh else None
+
+    if schema is None or set(schema) != set(df.columns):
+        schema, changed = infer_schema(df, precision), True
+    else:
+        schema, changed = widen_schema(df, schema)
+    data = apply_schema(df, schema)[df.columns]
+
+    if cache_path is not None and dataset is not None and changed:
+        cache[dataset] = schema
+        save_schema_cache(cache_path, cache)
+
+    if verbose:
+        report = memory_report(df, data)
+        start, end = report['memory_before_mb'].sum(), report['memory_after_mb'].sum()
+        diff = start - end
+        percent = diff / start * 100 if start > 0 else 0
+        print(f'Start Memory: {start:.2f} MB \tEnd Memory: {end:.2f}MB\nMemory Reduced: {diff:.2f}MB ({percent:.2f}%)')
+    return data
@@ -0,0 +1,225 @@
+"""
+DuckDB storage of the hourly pickup and dropoff rides (TLC_trips.duckdb)
+
+The hourly rides of stations are aggregated with SQL over the monthly trip files
+(yellow_tripdata_YYYY-MM.parquet) read by DuckDB, so rides are never loaded into pandas,
+and stored in columnar tables with the same names and columns as in TLC_trips.sqlite.
+The trip files are also available as the trips view, e.g.
+
+    conn = connect('TLC_trips.duckdb')
+    query(conn, 'SELECT PULocationID, COUNT(*) FROM trips GROUP BY 1')
+
+DataFrames and Arrow tables are inserted by DuckDB scanning them in place (zero-copy for Arrow).
+"""
+import datetime
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+
+
+# hourly rides table, station column and trip column of the station of pickups and dropoffs
+TABLES = {
+    'pickup' : ('pickup_trips', 'pickup_station', 'PULocationID'),
+    'dropoff' : ('dropoff_trips', 'dropoff_station', 'DOLocationID')
+}
+
+
+def connect(db_path):
+    """
+    Opens (or creates) a DuckDB database file
+    """
+    import duckdb
+    return duckdb.connect(db_path)
+
+
+def get_month_range(trip_file):
+    """
+    Returns the start of the month of a trip file (yellow_tripdata_YYYY-MM.parquet) and the start of the next month
+    """
+    month_start = pd.to_datetime(re.search('[0-9]{4}-[0-9]{2}', os.path.basename(trip_file)).group())
+    return month_start, month_start + pd.offsets.MonthBegin(1)
+
+
+def paid_rides_query(trip_files):
+    """
+    SQL of the rides paid by cash (1) or credit card (0) with a positive total amount, picked up within the
+    month of their trip file. Files are scanned one by one with the month as a literal, so DuckDB skips row
+    groups outside of it and columns are cast to the same types (station IDs and timestamps differ by year)
+
+    :param trip_files: yellow_tripdata_YYYY-MM.parquet files
+    """
+    scans = []
+    for trip_file in trip_files:
+        month_start, next_month_start = get_month_range(trip_file)
+        scans.append(f"""
+        SELECT CAST(tpep_pickup_datetime AS TIMESTAMP) AS pickup_datetime,
+               CAST(tpep_dropoff_datetime AS TIMESTAMP) AS dropoff_datetime,
+               CAST(PULocationID AS INTEGER) AS PULocationID, CAST(DOLocationID AS INTEGER) AS DOLocationID,
+               payment_type, total_amount, trip_distance, fare_amount
+        FROM read_parquet('{trip_file}')
+        WHERE payment_type < 2 AND total_amount > 0
+          AND tpep_pickup_datetime >= TIMESTAMP '{month_start}' AND tpep_pickup_datetime < TIMESTAMP '{next_month_start}'
+        """)
+    return '\nUNION ALL\n'.join(scans)
+
+
+def hourly_rides_query(trip_files, kind='pickup'):
+    """
+    SQL of the rides, revenue (of pickups), average duration and distance and fare cost of every station per
+    hour of pickup, as computed by combine_hourly_rides in preprocess_taxi_rides.py
+
+    :param trip_files: yellow_tripdata_YYYY-MM.parquet files
+    :param kind: pickup or dropoff
+    """
+    _, station_column, trip_column = TABLES[kind]
+    revenue = 'SUM(total_amount) AS revenue,' if kind == 'pickup' else ''
+    return f"""
+    SELECT date_trunc('hour', pickup_datetime) AS ride_datetime, {trip_column} AS {station_column},
+           COUNT(payment_type) AS hourly_rides, {revenue}
+           AVG(date_diff('microsecond', pickup_datetime, dropoff_datetime) / 1e6) AS duration_secs,
+           AVG(trip_distance) AS distance_miles, SUM(fare_amount) AS total_fare_cost
+    FROM ({paid_rides_query(trip_files)})
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    """
+
+
+def register_data(conn, data):
+    """
+    Returns SQL reading data: a query (str) or a DataFrame or Arrow table scanned in place by DuckDB
+    """
+    if isinstance(data, str):
+        return f'({data})'
+    conn.register('data_to_insert', data)
+    return 'data_to_insert'
+
+
+def create_table(conn, table_name, source, primary_key=None):
+    """
+    Creates (or replaces) an empty table with the columns of source and a primary key
+    """
+    columns = conn.execute(f'DESCRIBE SELECT * FROM {source}').fetchall()
+    db_cols = ', '.join(f'{column[0]} {column[1]}' for column in columns)
+    if primary_key is not None:
+        db_cols = db_cols + f', PRIMARY KEY ({", ".join(primary_key)})'
+    conn.execute(f'CREATE OR REPLACE TABLE {table_name} ({db_cols});')
+
+
+def write_data(conn, table_name, data, primary_key=None, replace=True):
+    """
+    Writes data to a table in one transaction (rolled back on errors)
+
+    :param data: SQL query, DataFrame or Arrow table to insert
+    :param replace: replace the table (rows with the same primary key are replaced otherwise)
+    """
+    source = register_data(conn, data)
+    conn.begin()
+    try:
+        tables = [name for name, in conn.execute('SELECT table_name FROM duckdb_tables();').fetchall()]
+        if replace or table_name not in tables:
+            create_table(conn, table_name, source, primary_key)
+        conn.execute(f'INSERT {"" if replace else "OR REPLACE "}INTO {table_name} SELECT * FROM {source};')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if source == 'data_to_insert':
+            conn.unregister(source)
+
+
+def insert_data_to_table(conn, table_name, data, primary_key=None):
+    """
+    Creates (or replaces) a table and inserts data
+
+    :param table_name: Name of table to create
+    :param data: SQL query, DataFrame or Arrow table to insert
+    :param primary_key: list of columns of the primary key of the table
+    """
+    write_data(conn, table_name, data, primary_key)
+    print(f'data inserted to {table_name}')
+
+
+def upsert_data_to_table(conn, table_name, data, primary_key):
+    """
+    Inserts data into a table (created if it doesn't exist), replacing rows with the same primary key
+
+    :param table_name: Name of table to update
+    :param data: SQL query, DataFrame or Arrow table to insert
+    :param primary_key: list of columns of the primary key of the table
+    """
+    write_data(conn, table_name, data, primary_key, replace=False)
+    print(f'data upserted to {table_name}')
+
+
+def get_loaded_months(conn):
+    """
+    Returns the months (YYYY-MM) of the trip files loaded in the database (kept in the loaded_months table)
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS loaded_months (month VARCHAR PRIMARY KEY, trip_file VARCHAR, loaded_at TIMESTAMP);')
+    return set(month for month, in conn.execute('SELECT month FROM loaded_months;').fetchall())
+
+
+def record_loaded_months(conn, trip_files):
+    get_loaded_months(conn)
+    loaded_at = datetime.datetime.now().replace(microsecond=0)
+    conn.executemany('INSERT OR REPLACE INTO loaded_months VALUES (?, ?, ?);',
+                     [(f'{get_month_range(trip_file)[0]:%Y-%m}', os.path.basename(trip_file), loaded_at)
+                      for trip_file in trip_files])
+
+
+def create_trips_view(conn, trip_files):
+    """
+    Creates the trips view of all rides in the trip files (columns of different files are matched by name)
+    """
+    files = ', '.join(f"'{trip_file}'" for trip_file in sorted(trip_files))
+    conn.execute(f'CREATE OR REPLACE VIEW trips AS SELECT * FROM read_parquet([{files}], union_by_name=true);')
+
+
+def load_trip_files(conn, trip_files, location_info=None, incremental=False):
+    """
+    Aggregates the hourly rides of trip files into pickup_trips and dropoff_trips
+
+    :param trip_files: yellow_tripdata_YYYY-MM.parquet files
+    :param location_info: DataFrame of station locations, saved to location_info
+    :param incremental: only aggregate trip files of months that aren't loaded yet and upsert their rides
+    (the tables are replaced with the rides of all trip files otherwise)
+    Returns the loaded trip files. Months are recorded as loaded only after their rides are written to both
+    tables, a failed write is rolled back and raised before any month is recorded
+    """
+    create_trips_view(conn, trip_files)
+    if location_info is not None:
+        insert_data_to_table(conn, 'location_info', location_info)
+
+    if incremental:
+        loaded_months = get_loaded_months(conn)
+        trip_files = [trip_file for trip_file in trip_files
+                      if f'{get_month_range(trip_file)[0]:%Y-%m}' not in loaded_months]
+        print(f'{len(trip_files)} new trip files')
+    if len(trip_files) == 0:
+        return trip_files
+
+    for kind, (table_name, station_column, _) in TABLES.items():
+        if incremental:
+            upsert_data_to_table(conn, table_name, hourly_rides_query(trip_files, kind), ['ride_datetime', station_column])
+        else:
+            insert_data_to_table(conn, table_name, hourly_rides_query(trip_files, kind), ['ride_datetime', station_column])
+    record_loaded_months(conn, trip_files)
+    return trip_files
+
+
+def query(conn, sql, params=None):
+    """
+    Runs a query and returns the result as an Arrow table (convert with .to_pandas() when it fits in memory)
+    """
+    # arrow() returns a table or, in newer DuckDB versions, a reader of record batches
+    return pa.table(conn.execute(sql, params).arrow())
+
+
+def export_table(conn, table_name, filepath):
+    """
+    Writes a table to a Parquet file
+    """
+    conn.execute(f"COPY {table_name} TO '{filepath}' (FORMAT PARQUET);")
@@ -33,71 +33,25 @@
 
 
 # import libraries
+import argparse
+import sys
 import pandas as pd
 import numpy as np
 import sqlite3
 from tqdm import tqdm
 from glob import glob
-import gc, re
+from itertools import groupby
 import datetime
-import pyarrow.parquet as pq
+import pyarrow as pa
+import pyarrow.dataset as ds
 from pathlib import os
 import pyarrow.compute as pc
-
-
-# get path
-path = os.getcwd()
+from query_taxi_rides import refresh_rollups
+from downcast_dtypes import reduce_memory
+from duckdb_taxi_rides import get_month_range
 
 
 # functions
-def reduce_memory(df):
-    start = df.memory_usage().sum() /1024**2
-
-    dtypes = df.dtypes
-    cols = dtypes.index.tolist()
-
-    for i in range(len(cols)):
-        col = cols[i]
-        col_type  = dtypes.iloc[i].name
-
-        if 'float' in col_type or 'int' in col_type:
-            c_min = df[col].min()
-            c_max = df[col].max()
-
-            if 'int' in col_type:
-                if c_min > np.iinfo(np.int8).min and c_max < np.iinfo(np.int8).max:
-                    df[col] = df[col].astype(np.int8)
-                elif c_min > np.iinfo(np.uint8).min and c_max < np.iinfo(np.uint8).max:
-                    df[col] = df[col].astype(np.uint8)
-                elif c_min > np.iinfo(np.int16).min and c_max < np.iinfo(np.int16).max:
-                    df[col] = df[col].astype(np.int16)
-                elif c_min > np.iinfo(np.uint16).min and c_max < np.iinfo(np.uint16).max:
-                    df[col] = df[col].astype(np.uint16)
-                elif c_min > np.iinfo(np.int32).min and c_max < np.iinfo(np.int32).max:
-                    df[col] = df[col].astype(np.int32)
-                elif c_min > np.iinfo(np.uint32).min and c_max < np.iinfo(np.uint32).max:
-                    df[col] = df[col].astype(np.uint32)
-                elif c_min > np.iinfo(np.int64).min and c_max < np.iinfo(np.int64).max:
-                    df[col] = df[col].astype(np.int64)
-                elif c_min > np.iinfo(np.uint64).min and c_max < np.iinfo(np.uint64).max:
-                    df[col] = df[col].astype(np.uint64)
-            else:
-                df[col] = df[col].astype(np.float32)
-                if c_min > np.finfo(np.float16).min and c_max < np.finfo(np.float16).max:
-                    df[col] = df[col].astype(np.float16)
-                elif c_min > np.finfo(np.float32).min and c_max < np.finfo(np.float32).max:
-                    df[col] = df[col].astype(np.float32)
-                else:
-                    df[col] = df[col].astype(np.float64)
-        elif col_type in ['object', 'category', 'datetime64[ns]']:
-            df[col] = df[col].astype('category')
-    
-    end = df.memory_usage().sum() /1024**2 
-    diff = (start-end)
-    print(f'Start Memory: {start:.2f} MB \tEnd Memory: {end:.2f}MB\nMemory Reduced: {diff:.2f}MB ({diff/start*100:.2f}%)')
-    return df
-
-
 def change_dtypes(x):
     """Function to change the data types of variables to SQL variables"""
     if 'int' in x.name:
@@ -159,15 +113,18 @@ def check_if_table_exists(cursor, table_name):
 
 
 
-def create_table(cursor, table_name, data):
+def create_table(cursor, table_name, data, primary_key=None):
     """
     Checks and creates table in database. Deletes table if table exists and returns user_input
     :param table_name: Name of table to create
     :param data: Dataset to create table from
+    :param primary_key: list of columns of the primary key of the table
 
     """
     user_input = check_if_table_exists(cursor, table_name)
     db_cols = create_table_columns(data)
+    if primary_key is not None:
+        db_cols = db_cols + f'PRIMARY KEY ({",".join(primary_key)})'
 
     # if user_input = '' (table hasn't been created before)
     # if user_input = 'Y' (table existed but has been dropped)
@@ -179,175 +136,358 @@ def create_table(cursor, table_name, data):
     return user_input
 
 
+def format_datetimes(values):
+    """
+    Formats datetimes (or categories of datetimes) as text, e.g. 2021-01-10 10:30:00, in one vectorized step
+    Hourly datetimes repeat, so only the unique values are formatted
+    """
+    codes, uniques = pd.factorize(pd.Series(values).astype('datetime64[ns]'))
+    uniques = np.asarray(uniques, dtype='datetime64[s]')
+    return np.char.replace(np.datetime_as_string(uniques, unit='s'), 'T', ' ')[codes]
+
+
+def create_table_index(cursor, table_name, columns):
+    """
+    Creates an index on columns of a table (after loading data, so rows are indexed once)
+    """
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_{"_".join(columns)} ON {table_name} ({",".join(columns)});')
+
+
+def write_rows(cursor, statement, data, chunksize=80000):
+    """
+    Executes an INSERT statement (with a parameter per column) for all rows of data in one transaction
+
+    :param statement: INSERT statement
+    :param data: Dataset to insert (with a ride_datetime column)
+    :param chunksize: number of rows converted to Python values at a time
+    """
+    conn = cursor.connection
+    ride_datetime = format_datetimes(data['ride_datetime'])
+    with conn: # one transaction (rolled back on errors)
+        for chunk in tqdm(range(0, len(data), chunksize), desc=f"Writing {len(data)} rows"):
+            chunk_df = data.iloc[chunk:chunk+chunksize]
+            # column lists of Python values, rows are zipped from them
+            values = [ride_datetime[chunk:chunk+chunksize].tolist() if col == 'ride_datetime'
+                      else chunk_df[col].to_numpy().tolist() for col in data.columns]
+            cursor.executemany(statement, zip(*values))
+
+
+def get_station_column(data):
+    return [col for col in data.columns if col.endswith('_station')][0]
+
+
 # Insert to table
-def insert_data_to_table(cursor, table_name, data):
+def insert_data_to_table(cursor, table_name, data, chunksize=80000):
+    """
+    Bulk loads data into a table (created if it doesn't exist) in one transaction and adds the unique key
+    (ride_datetime, station) and the index of station and ride_datetime afterwards, so rows aren't indexed
+    while they are inserted. The journal is written ahead (WAL) without syncing to disk during the load
+    Returns whether the rows were written (False if the table was kept or the load failed)
+
+    :param table_name: Name of table to create
+    :param data: Dataset to insert (with a ride_datetime column)
+    :param chunksize: number of rows converted to Python values at a time
+    """
+    station_column = get_station_column(data)
+    inserted = False
     user_input = create_table(cursor, table_name, data)
 
     if user_input.upper() == 'Y' or user_input == '':
+        conn = cursor.connection
+        conn.commit()
+        cursor.execute('PRAGMA journal_mode=WAL;')
+        cursor.execute('PRAGMA synchronous=OFF;')
         try:
-            # get table columns
-            table_cols = [i[0] for i in cursor.execute(f'Select * from {table_name};').description]
-
             # insert data into table
-            query = ','.join(table_cols) # columns
-            val_query = '?,'*len(table_cols)
-            
-            data_query = """INSERT INTO {} ({}) VALUES ({});""".format(table_name, query, val_query)
-            data_query = data_query.replace('[', '').replace(']', '').replace(',)', ')')
-            
-            for chunk in tqdm(range(0, len(df), size), desc=f"Writing to {table_name} table"):
-
-                chunk_df = df.iloc[chunk:chunk+size, :]
-                datetime_format = '[0-9]{,4}-[0-9]{,2}-[0-9]{,2} [0-9]{,2}:[0-9]{,2}:[0-9]{,2}' # 2021-01-10 10:30:00
-                chunk_df =  chunk_df.assign(
-                    ride_datetime = chunk_df['ride_datetime'].apply(lambda x: re.search(datetime_format, str(x)).group())
-                    )
-
-                chunk_df = chunk_df.values.tolist()
-                
-                cursor.executemany(data_query, chunk_df)
+            query = ','.join(data.columns) # columns
+            val_query = ','.join('?'*len(data.columns))
+            write_rows(cursor, f'INSERT INTO {table_name} ({query}) VALUES ({val_query});', data, chunksize)
+
+            # rides by time are found with the unique key (which upserts replace rows by) and rides of a
+            # station with the index
+            create_table_key(cursor, table_name, ['ride_datetime', station_column])
+            create_table_index(cursor, table_name, [station_column, 'ride_datetime'])
+            conn.commit()
+            inserted = True
             print(f'data inserted to {table_name}')
         except Exception as err:
             print(err)
+        finally:
+            cursor.execute('PRAGMA synchronous=FULL;')
+            cursor.execute('PRAGMA journal_mode=DELETE;')
     elif user_input.upper()  == 'N':
         print('Table not created!\n')
+    return inserted
 
 
+def create_table_key(cursor, table_name, key_columns):
+    """
+    Adds a unique index on key_columns to a table without that primary key (bulk loaded, or created before
+    tables had keys), so rows with the same key are replaced by INSERT OR REPLACE
+    """
+    primary_key = [row[1] for row in sorted(cursor.execute(f'PRAGMA table_info({table_name});').fetchall(),
+                                            key=lambda row: row[5]) if row[5] > 0]
+    if primary_key != key_columns:
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_key ON {table_name} ({",".join(key_columns)});')
 
-# get location information
-location_info = pd.read_csv(f'{path}/location_info.csv')
 
-# get all trip files
-trips = glob(f'{path}/data/yellow_tripdata*.parquet')
+def upsert_data_to_table(cursor, table_name, data, chunksize=80000):
+    """
+    Inserts data into a table (created if it doesn't exist, with the primary key ride_datetime and station)
+    in one transaction, replacing rows of the same hour and station
 
+    :param table_name: Name of table to update
+    :param data: Dataset to insert (with a ride_datetime column)
+    :param chunksize: number of rows converted to Python values at a time
+    """
+    key_columns = ['ride_datetime', get_station_column(data)]
+    table = f'CREATE TABLE IF NOT EXISTS {table_name} ({create_table_columns(data)}PRIMARY KEY ({",".join(key_columns)}))'
+    cursor.execute(table)
+    create_table_key(cursor, table_name, key_columns)
+    create_table_index(cursor, table_name, key_columns[::-1])
 
-pickup_df = []
-dropoff_df = []
+    query = ','.join(data.columns) # columns
+    val_query = ','.join('?'*len(data.columns))
+    write_rows(cursor, f'INSERT OR REPLACE INTO {table_name} ({query}) VALUES ({val_query});', data, chunksize)
+    print(f'{len(data)} rows upserted to {table_name}')
 
-for i in tqdm(range(len(trips)), desc='Reading Datasets'):
-    # get month
-    month = re.search('[0-9]{,4}-[0-9]{,2}', trips[i]).group()
-    month_start = pd.to_datetime(month)
-    month_start = re.search('[0-9]{,4}-[0-9]{,2}-[0-9]{,2}', str(month_start)).group()
-    month_end = pd.date_range(month_start, periods=1, freq='ME')[0]
-    month_end = str(month_end.date()) + ' 23:59:00'
-    
-    # load data
-    temp = pq.read_table(
-        trips[i], 
-        columns=['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'payment_type', 
-                 'PULocationID', 'DOLocationID', 'total_amount', 'trip_distance', 
-                 'fare_amount']
-                 )
-                                            
-    # filter rides that riders paid by cash (1), credit card (0)
-    temp = temp.filter(pc.field('payment_type') < 2)
-
-    # filter total amount that are positive
-    temp = temp.filter(pc.field('total_amount') > 0)
-
-    # convert to pandas dataframe
-    temp = temp.to_pandas()
-    temp['duration_secs'] = (temp.tpep_dropoff_datetime - temp.tpep_pickup_datetime).dt.total_seconds()
-
-    # aggregate
-    # convert to nearest hour range
-    temp.tpep_pickup_datetime = pd.DatetimeIndex(temp.tpep_pickup_datetime).floor('h')
-
-    # get pickup station data
-    pickup_data = temp.groupby(['tpep_pickup_datetime', 'PULocationID']).agg(
-        {
-        'payment_type' : 'count', 
-        'total_amount' : 'sum', 
-        'duration_secs' : 'mean',
-        'trip_distance' : 'mean',
-        'fare_amount' : 'sum'
-        })
-    
-    pickup_data = pickup_data.reset_index()
-    pickup_data = pickup_data.rename(
-        {
-        'tpep_pickup_datetime' : 'ride_datetime', 
-        'payment_type' : 'hourly_rides',
-        'PULocationID' : 'pickup_station',
-        'trip_distance' : 'distance_miles', 
-        'total_amount' : 'revenue',
-        'fare_amount' : 'total_fare_cost'
-        }, axis=1)
-    
-    # filter pickupdata within month
-    pickup_data = pickup_data.query(f"ride_datetime >= '{month_start}' & ride_datetime <= '{month_end}'")
-    
-    
-    pickup_df.append(pickup_data)
-
-    # get dropoff station data (total number of rides going to drop off station)
-    dropoff_data = temp.groupby(['tpep_pickup_datetime', 'DOLocationID']).agg(
-        {
-        'payment_type' : 'count',
-        'duration_secs' : 'mean',
-        'trip_distance' : 'mean',
-        'fare_amount' : 'sum'
-        })
 
-    dropoff_data = dropoff_data.reset_index()
-    dropoff_data = dropoff_data.rename(
-        {
-        'tpep_pickup_datetime' : 'ride_datetime', 
-        'payment_type' : 'hourly_rides',
-        'DOLocationID' : 'dropoff_station',
-        'trip_distance' : 'distance_miles',
-        'fare_amount' : 'total_fare_cost'
-        }, axis=1)
-    
-    # filter dropoff data within month
-    dropoff_data = dropoff_data.query(f"ride_datetime >= '{month_start}' & ride_datetime <= '{month_end}'")
-    
-    
-    dropoff_df.append(dropoff_data)
+def get_loaded_months(cursor):
+    """
+    Returns the months (YYYY-MM) of the trip files loaded in the database (kept in the loaded_months table)
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS loaded_months (month TEXT PRIMARY KEY, trip_file TEXT, loaded_at TEXT);')
+    return set(month for month, in cursor.execute('SELECT month FROM loaded_months;').fetchall())
 
 
-    gc.collect()
+def record_loaded_months(cursor, trip_files):
+    """
+    Records the months of trip files as loaded in the database
+    A month is loaded again after deleting its row from loaded_months
 
-pickup_df = pd.concat(pickup_df)
-pickup_df = pickup_df.reset_index(drop=True)
+    :param trip_files: yellow_tripdata_YYYY-MM.parquet files
+    """
+    get_loaded_months(cursor)
+    loaded_at = datetime.datetime.now().isoformat(timespec='seconds')
+    with cursor.connection:
+        cursor.executemany('INSERT OR REPLACE INTO loaded_months (month, trip_file, loaded_at) VALUES (?,?,?);',
+                           [(f'{get_month_range(trip_file)[0]:%Y-%m}', os.path.basename(trip_file), loaded_at)
+                            for trip_file in trip_files])
 
-dropoff_df = pd.concat(dropoff_df)
-dropoff_df = dropoff_df.reset_index(drop=True)
 
-# reduce memory
-pickup_df = reduce_memory(pickup_df)
-dropoff_df = reduce_memory(dropoff_df)
+def get_new_trip_files(cursor, trip_files):
+    """
+    Returns the trip files of months that aren't loaded in the database
+    """
+    loaded_months = get_loaded_months(cursor)
+    return [trip_file for trip_file in trip_files if f'{get_month_range(trip_file)[0]:%Y-%m}' not in loaded_months]
+
+
+def update_saved_rides(filepath, data):
+    """
+    Returns the rides saved at filepath with the months of data replaced by data
+    """
+    if not os.path.exists(filepath):
+        return data
+    saved = pd.read_parquet(filepath)
+    saved_datetime = saved['ride_datetime'].astype('datetime64[ns]')
+    new_months = data['ride_datetime'].astype('datetime64[ns]').dt.to_period('M').unique()
+    saved = saved[~saved_datetime.dt.to_period('M').isin(new_months)]
+
+    data = pd.concat([saved.astype({'ride_datetime' : 'datetime64[ns]'}),
+                      data.astype({'ride_datetime' : 'datetime64[ns]'})], ignore_index=True)
+    return data.sort_values(['ride_datetime', get_station_column(data)], ignore_index=True)
+
 
-# convert revenue back to float32
-pickup_df['revenue'] = np.round(pickup_df['revenue'].astype('float64'), 2).astype('float32')
+TRIP_COLUMNS = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 'payment_type',
+                'PULocationID', 'DOLocationID', 'total_amount', 'trip_distance', 'fare_amount']
 
-# save data
-pickup_df.to_parquet(f'{path}/data/pickup_rides.parquet')
-dropoff_df.to_parquet(f'{path}/data/dropoff_rides.parquet')
 
+def read_trip_batches(trip_files, batch_size=500_000):
+    """
+    Scans trip files as one Parquet dataset and yields (month_start, record batch) of paid rides
 
+    Rides paid by cash (1) or credit card (0) with a positive total amount, picked up within the month
+    of the file, are filtered by the reader: row groups whose statistics rule out the filter are skipped
+    without being decompressed, and only the trip columns of the remaining row groups are read
 
-# # last date of collected data
-# last_date = '2024-01-01'
-# last_date = datetime.datetime.strptime(last_date, '%Y-%m-%d')
-# # extract date part of dataset name
-# trips_date = list(map(lambda x: re.search('[0-9]{,4}-[0-9]{,2}', x).group()), trips)
-# # convert to datetime
-# trips_date = list(map(lambda x: datetime.datetime.strptime(x, '%Y-%m'), trips_date))
+    :param trip_files: yellow_tripdata*.parquet files
+    :param batch_size: maximum number of rides in a batch
+    """
+    dataset = ds.dataset(trip_files, format='parquet')
+    for fragment in dataset.get_fragments():
+        month_start, next_month_start = get_month_range(fragment.path)
+        pickup_datetime = pc.field('tpep_pickup_datetime')
+        trip_filter = ((pc.field('payment_type') < 2) & (pc.field('total_amount') > 0) &
+                       (pickup_datetime >= month_start.to_pydatetime()) &
+                       (pickup_datetime < next_month_start.to_pydatetime()))
 
-# is_new_data = np.array(trips_date) > np.array(last_date)
-# new_trips_data = trips[is_new_data] # get new data to update table
+        for row_group in fragment.split_by_row_group(trip_filter):
+            for batch in row_group.to_batches(columns=TRIP_COLUMNS, filter=trip_filter, batch_size=batch_size):
+                yield month_start, batch
 
 
+# partial aggregates of rides per hour and station, combined across batches by summing
+HOURLY_AGGREGATES = [('payment_type', 'count'), ('total_amount', 'sum'), ('duration_secs', 'sum'),
+                     ('duration_secs', 'count'), ('trip_distance', 'sum'), ('trip_distance', 'count'),
+                     ('fare_amount', 'sum')]
 
 
-# create database
+def aggregate_hourly_rides(batch):
+    """
+    Aggregates a batch of rides by pickup hour at pickup and dropoff stations into sums and counts
+    with pyarrow (without converting to pandas), which can be combined across batches (see combine_hourly_rides)
+
+    :param batch: record batch of rides (TRIP_COLUMNS)
+    Returns the aggregates of pickup (PULocationID) and dropoff (DOLocationID) stations
+    """
+    pickup_datetime = batch.column('tpep_pickup_datetime')
+    dropoff_datetime = batch.column('tpep_dropoff_datetime')
+    unit_seconds = {'s' : 1, 'ms' : 1e3, 'us' : 1e6, 'ns' : 1e9}[pickup_datetime.type.unit]
+
+    # station IDs and hours have the same types in all files (int32/int64 IDs, us/ns timestamps)
+    rides = pa.table({
+        'ride_datetime' : pc.floor_temporal(pickup_datetime, unit='hour').cast(pa.timestamp('ns')),
+        'PULocationID' : batch.column('PULocationID').cast(pa.int64()),
+        'DOLocationID' : batch.column('DOLocationID').cast(pa.int64()),
+        'payment_type' : batch.column('payment_type'),
+        'total_amount' : batch.column('total_amount'),
+        'duration_secs' : pc.divide(pc.subtract(dropoff_datetime, pickup_datetime).cast(pa.int64()), unit_seconds),
+        'trip_distance' : batch.column('trip_distance'),
+        'fare_amount' : batch.column('fare_amount')
+        })
+    return [rides.group_by(['ride_datetime', station_column]).aggregate(HOURLY_AGGREGATES)
+            for station_column in ['PULocationID', 'DOLocationID']]
+
+
+def combine_hourly_rides(partials, station_column):
+    """
+    Combines hourly aggregates of batches into the rides, revenue, average duration, average distance
+    and fare cost of every station per hour
+
+    :param partials: list of aggregates (Arrow tables) from aggregate_hourly_rides
+    :param station_column: PULocationID or DOLocationID
+    """
+    keys = ['ride_datetime', station_column]
+    columns = [f'{column}_{aggregate}' for column, aggregate in HOURLY_AGGREGATES]
+    data = pa.concat_tables(partials).group_by(keys).aggregate([(column, 'sum') for column in columns])
+
+    data = pa.table({
+        'ride_datetime' : data['ride_datetime'],
+        station_column : data[station_column],
+        'hourly_rides' : data['payment_type_count_sum'],
+        'revenue' : data['total_amount_sum_sum'],
+        'duration_secs' : pc.divide(data['duration_secs_sum_sum'], data['duration_secs_count_sum']),
+        'distance_miles' : pc.divide(data['trip_distance_sum_sum'], data['trip_distance_count_sum']),
+        'total_fare_cost' : data['fare_amount_sum_sum']
+        })
+    return data.sort_by([(key, 'ascending') for key in keys]).to_pandas()
+
+
+
+# command line options, e.g. the monthly refresh of new trip files:
+#     python preprocess_taxi_rides.py --path /data/taxi --incremental
+parser = argparse.ArgumentParser(description='Aggregates the hourly rides of stations in yellow taxi trip files')
+parser.add_argument('--path', default=os.getcwd(),
+                    help='directory of location_info.csv, data/ (trip files and saved rides) and the database')
+parser.add_argument('--incremental', action='store_true',
+                    help='only load trip files of months that are not in the database yet and upsert their rides')
+parser.add_argument('--storage', choices=['sqlite', 'duckdb'], default='sqlite',
+                    help='database of hourly rides: TLC_trips.sqlite or TLC_trips.duckdb')
+args = parser.parse_args()
+
+# get path
+path = args.path
+
+# get location information
+location_info = pd.read_csv(f'{path}/location_info.csv')
+
+# get all trip files
+trips = glob(f'{path}/data/yellow_tripdata*.parquet')
+
+# only process trip files of months that aren't in the database yet and upsert their rides
+# (all trip files are processed and the tables are dropped and reloaded otherwise)
+incremental = args.incremental
+
+# database of hourly rides: sqlite (TLC_trips.sqlite) or duckdb (TLC_trips.duckdb, rides are aggregated
+# with SQL over the trip files without loading them into pandas)
+storage = args.storage
+
+# saved hourly rides, downcast with the schemas of full loads reused by incremental updates so every month
+# has the same dtypes
+# decimals kept in the hourly aggregates: amounts in cents, distances in 1/100 miles and durations in seconds
+pickup_file = f'{path}/data/pickup_rides.parquet'
+dropoff_file = f'{path}/data/dropoff_rides.parquet'
+precision = {'revenue' : 2, 'total_fare_cost' : 2, 'distance_miles' : 2, 'duration_secs' : 0}
+schema_cache = f'{path}/data/schema_cache.json'
+
+if storage == 'duckdb':
+    from duckdb_taxi_rides import connect, load_trip_files, query
+
+    conn = connect(f'{path}/TLC_trips.duckdb')
+    loaded_trips = load_trip_files(conn, trips, location_info, incremental)
+    # the tables hold the rides of all loaded months (saved again only when months were loaded)
+    if len(loaded_trips) > 0:
+        for table_name, dataset, filepath in [('pickup_trips', 'pickup_rides', pickup_file),
+                                              ('dropoff_trips', 'dropoff_rides', dropoff_file)]:
+            data = query(conn, f'SELECT * FROM {table_name} ORDER BY 1, 2;').to_pandas()
+            reduce_memory(data, dataset, precision, schema_cache, refresh=not incremental).to_parquet(filepath)
+    conn.close()
+    sys.exit(0)
 
 # create database connection
 conn = sqlite3.connect(f'{path}/TLC_trips.sqlite') #db
 cursor = conn.cursor()
 
+if incremental:
+    trips = get_new_trip_files(cursor, trips)
+    if len(trips) == 0:
+        print('No new trip files')
+        conn.close()
+        sys.exit(0)
+    print(f'{len(trips)} new trip files')
+
+
+pickup_df = []
+dropoff_df = []
+
+# aggregate every batch of rides at pickup and dropoff stations, only the hourly aggregates are kept in memory
+# rides are picked up within the month of their file, so the combined aggregates of a month are final
+batches = tqdm(read_trip_batches(trips), desc='Reading Datasets')
+for month_start, month_batches in groupby(batches, key=lambda x: x[0]):
+    pickup_data = []
+    dropoff_data = []
+    for _, batch in month_batches:
+        pickup_aggregates, dropoff_aggregates = aggregate_hourly_rides(batch)
+        pickup_data.append(pickup_aggregates)
+        # total number of rides going to drop off station
+        dropoff_data.append(dropoff_aggregates)
+
+    pickup_df.append(combine_hourly_rides(pickup_data, 'PULocationID'))
+    dropoff_df.append(combine_hourly_rides(dropoff_data, 'DOLocationID'))
+
+pickup_df = pd.concat(pickup_df, ignore_index=True)
+pickup_df = pickup_df.rename({'PULocationID' : 'pickup_station'}, axis=1)
+
+dropoff_df = pd.concat(dropoff_df, ignore_index=True).drop(columns='revenue')
+dropoff_df = dropoff_df.rename({'DOLocationID' : 'dropoff_station'}, axis=1)
+
+# reduce memory
+pickup_df = reduce_memory(pickup_df, 'pickup_rides', precision, schema_cache, refresh=not incremental)
+dropoff_df = reduce_memory(dropoff_df, 'dropoff_rides', precision, schema_cache, refresh=not incremental)
+
+# save data (with the other months saved before in incremental mode)
+if incremental:
+    update_saved_rides(pickup_file, pickup_df).to_parquet(pickup_file)
+    update_saved_rides(dropoff_file, dropoff_df).to_parquet(dropoff_file)
+else:
+    pickup_df.to_parquet(pickup_file)
+    dropoff_df.to_parquet(dropoff_file)
+
+
+
+# create database
+
 # saving location info to sql
 location_info.to_sql(name='location_info', con=conn, if_exists='replace', index=False)
 
@@ -358,10 +498,24 @@ size = 80000 # chunk size for writing to database
 table_names = ['pickup_trips', 'dropoff_trips']
 data = [pickup_df, dropoff_df]
 
+written = []
 for i in range(len(table_names)):
-    table_name = table_names[i]
-    df = data[i]
-    insert_data_to_table(cursor, table_name, df)
+    if incremental:
+        # errors are raised, so the months aren't recorded
+        upsert_data_to_table(cursor, table_names[i], data[i], size)
+        written.append(True)
+    else:
+        written.append(insert_data_to_table(cursor, table_names[i], data[i], size))
+
+# months are recorded after their rides are written to all tables, so months of an interrupted update
+# (or of a kept table) are loaded again
+if all(written):
+    record_loaded_months(cursor, trips)
+else:
+    print('Trip files not recorded as loaded, rides were not written to all tables')
+
+# daily and weekly rollups of stations (from the first new month in incremental mode)
+refresh_rollups(conn, min(get_month_range(trip_file)[0] for trip_file in trips) if incremental else None)
 
 # close database
 conn.commit()
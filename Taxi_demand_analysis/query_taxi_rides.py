@@ -0,0 +1,232 @@
+"""
+Queries of the hourly pickup and dropoff rides in TLC_trips.sqlite for dashboards
+
+Station time series are read with composite (station, ride_datetime) indexes and daily/weekly
+totals from rollup tables (pickup_daily, pickup_weekly, dropoff_daily, dropoff_weekly) joined to
+location_info. Every query can also run on the hourly tables without indexes (indexed=False),
+which is the baseline of the benchmark:
+
+    python query_taxi_rides.py
+"""
+import os
+import sqlite3
+import timeit
+
+import pandas as pd
+
+
+# hourly rides table and station column of pickups and dropoffs
+TABLES = {
+    'pickup' : ('pickup_trips', 'pickup_station'),
+    'dropoff' : ('dropoff_trips', 'dropoff_station')
+}
+
+# start of the day or week (Monday) of an hour
+PERIODS = {
+    'daily' : "date(ride_datetime)",
+    'weekly' : "date(ride_datetime, 'weekday 0', '-6 days')"
+}
+
+
+def rollup_measures(kind):
+    """
+    Columns of rides, revenue (of pickups), average duration and distance (weighted by hourly rides)
+    and fare cost of hourly rides aggregated over a period
+    """
+    measures = ['SUM(hourly_rides) AS rides']
+    if kind == 'pickup':
+        measures.append('SUM(revenue) AS revenue')
+    measures += ['SUM(duration_secs * hourly_rides) / SUM(hourly_rides) AS duration_secs',
+                 'SUM(distance_miles * hourly_rides) / SUM(hourly_rides) AS distance_miles',
+                 'SUM(total_fare_cost) AS total_fare_cost']
+    return ', '.join(measures)
+
+
+def format_time(time, fmt='%Y-%m-%d %H:%M:%S'):
+    return pd.Timestamp(time).strftime(fmt)
+
+
+def create_query_indexes(conn):
+    """
+    Creates (station, ride_datetime) indexes of the hourly tables, which replace the station indexes
+    """
+    for table_name, station_column in TABLES.values():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_{station_column}_ride_datetime '
+                     f'ON {table_name} ({station_column}, ride_datetime);')
+        conn.execute(f'DROP INDEX IF EXISTS idx_{table_name}_{station_column};')
+    conn.commit()
+
+
+def refresh_rollups(conn, since=None):
+    """
+    Recomputes the daily and weekly rollups of pickups and dropoffs from the hourly tables
+
+    :param conn: connection to the database
+    :param since: first hour of new or updated rides (all rollups are rebuilt if None)
+    """
+    tables = [name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+    with conn:
+        for kind, (table_name, station_column) in TABLES.items():
+            for freq, period in PERIODS.items():
+                rollup = f'{kind}_{freq}'
+                # rollup rows of hourly rides at or after since
+                rollup_query = f"""
+                SELECT r.*, l.zone, l.borough
+                FROM (
+                    SELECT {period} AS ride_date, {station_column}, {rollup_measures(kind)}
+                    FROM {table_name}
+                    WHERE ride_datetime >= ?
+                    GROUP BY 1, 2
+                ) r
+                LEFT JOIN location_info l ON l.ride_station = r.{station_column}
+                """
+                if since is None or rollup not in tables:
+                    conn.execute(f'DROP TABLE IF EXISTS {rollup};')
+                    conn.execute(f'CREATE TABLE {rollup} AS {rollup_query};', ('',))
+                    conn.execute(f'CREATE UNIQUE INDEX idx_{rollup}_key ON {rollup} ({station_column}, ride_date);')
+                    conn.execute(f'CREATE INDEX idx_{rollup}_ride_date ON {rollup} (ride_date);')
+                else:
+                    # the day or week of since may have had rides before, so it is recomputed whole
+                    period_start = conn.execute(f'SELECT {period} FROM (SELECT ? AS ride_datetime);',
+                                                (format_time(since),)).fetchone()[0]
+                    conn.execute(f'DELETE FROM {rollup} WHERE ride_date >= ?;', (period_start,))
+                    conn.execute(f'INSERT INTO {rollup} {rollup_query};', (period_start,))
+
+
+def station_time_series(conn, station, start, end, kind='pickup', freq='hourly', indexed=True):
+    """
+    Returns the rides (and revenue of pickups) of a station per hour, day or week between start and end
+
+    :param station: pickup or dropoff station (location ID)
+    :param start: first hour (or day) of the series
+    :param end: end of the series (excluded)
+    :param kind: pickup or dropoff
+    :param freq: hourly, daily or weekly
+    :param indexed: read the indexes and rollups (the hourly tables are scanned otherwise)
+    """
+    table_name, station_column = TABLES[kind]
+    if freq == 'hourly':
+        columns = 'ride_datetime, hourly_rides' + (', revenue' if kind == 'pickup' else '')
+        query = f"""
+        SELECT {columns} FROM {table_name} {'' if indexed else 'NOT INDEXED'}
+        WHERE {station_column} = ? AND ride_datetime >= ? AND ride_datetime < ?
+        ORDER BY ride_datetime
+        """
+        params = (station, format_time(start), format_time(end))
+    elif indexed:
+        columns = 'ride_date, rides' + (', revenue' if kind == 'pickup' else '')
+        query = f"""
+        SELECT {columns} FROM {kind}_{freq}
+        WHERE {station_column} = ? AND ride_date >= ? AND ride_date < ?
+        ORDER BY ride_date
+        """
+        params = (station, format_time(start, '%Y-%m-%d'), format_time(end, '%Y-%m-%d'))
+    else:
+        columns = 'SUM(hourly_rides) AS rides' + (', SUM(revenue) AS revenue' if kind == 'pickup' else '')
+        query = f"""
+        SELECT {PERIODS[freq]} AS ride_date, {columns} FROM {table_name} NOT INDEXED
+        WHERE {station_column} = ? AND {PERIODS[freq]} >= ? AND {PERIODS[freq]} < ?
+        GROUP BY 1 ORDER BY 1
+        """
+        params = (station, format_time(start, '%Y-%m-%d'), format_time(end, '%Y-%m-%d'))
+    return pd.read_sql(query, conn, params=params)
+
+
+def top_zones(conn, start, end, n=10, kind='pickup', metric='rides', indexed=True):
+    """
+    Returns the n stations (zones) with the most rides (or revenue of pickups) between the days start and end
+
+    :param start: first day
+    :param end: end day (excluded)
+    :param metric: rides or revenue
+    :param indexed: read the daily rollup (the hourly table is scanned otherwise)
+    """
+    table_name, station_column = TABLES[kind]
+    columns = 'SUM(rides) AS rides' + (', SUM(revenue) AS revenue' if kind == 'pickup' else '')
+    if indexed:
+        source = f'{kind}_daily'
+    else:
+        source = f"""(
+            SELECT date(ride_datetime) AS ride_date, {station_column}, zone, borough, hourly_rides AS rides
+            {', revenue' if kind == 'pickup' else ''}
+            FROM {table_name} NOT INDEXED
+            LEFT JOIN location_info ON ride_station = {station_column}
+        )"""
+    query = f"""
+    SELECT {station_column}, zone, borough, {columns}
+    FROM {source}
+    WHERE ride_date >= ? AND ride_date < ?
+    GROUP BY {station_column}
+    ORDER BY {metric} DESC, {station_column}
+    LIMIT ?
+    """
+    return pd.read_sql(query, conn, params=(format_time(start, '%Y-%m-%d'), format_time(end, '%Y-%m-%d'), n))
+
+
+def borough_totals(conn, start, end, kind='pickup', indexed=True):
+    """
+    Returns the rides (and revenue of pickups) and the number of stations of every borough between the days
+    start and end
+
+    :param start: first day
+    :param end: end day (excluded)
+    :param indexed: read the daily rollup (the hourly table is scanned otherwise)
+    """
+    table_name, station_column = TABLES[kind]
+    columns = 'SUM(rides) AS rides' + (', SUM(revenue) AS revenue' if kind == 'pickup' else '')
+    if indexed:
+        source = f'{kind}_daily'
+    else:
+        source = f"""(
+            SELECT date(ride_datetime) AS ride_date, {station_column}, borough, hourly_rides AS rides
+            {', revenue' if kind == 'pickup' else ''}
+            FROM {table_name} NOT INDEXED
+            LEFT JOIN location_info ON ride_station = {station_column}
+        )"""
+    query = f"""
+    SELECT borough, COUNT(DISTINCT {station_column}) AS stations, {columns}
+    FROM {source}
+    WHERE ride_date >= ? AND ride_date < ?
+    GROUP BY borough
+    ORDER BY rides DESC
+    """
+    return pd.read_sql(query, conn, params=(format_time(start, '%Y-%m-%d'), format_time(end, '%Y-%m-%d')))
+
+
+def benchmark_queries(conn, station, start, end, repeat=5):
+    """
+    Times every query with indexes and rollups and on the un-indexed hourly tables (best of repeat runs)
+    and returns the seconds and speedups
+    """
+    queries = {
+        'hourly station series' : lambda indexed: station_time_series(conn, station, start, end, 'pickup', 'hourly', indexed),
+        'daily station series' : lambda indexed: station_time_series(conn, station, start, end, 'pickup', 'daily', indexed),
+        'weekly station series' : lambda indexed: station_time_series(conn, station, start, end, 'pickup', 'weekly', indexed),
+        'top 10 pickup zones' : lambda indexed: top_zones(conn, start, end, 10, 'pickup', 'rides', indexed),
+        'top 10 dropoff zones' : lambda indexed: top_zones(conn, start, end, 10, 'dropoff', 'rides', indexed),
+        'borough totals' : lambda indexed: borough_totals(conn, start, end, 'pickup', indexed)
+    }
+    results = []
+    for name, query in queries.items():
+        baseline = min(timeit.repeat(lambda: query(False), number=1, repeat=repeat))
+        indexed = min(timeit.repeat(lambda: query(True), number=1, repeat=repeat))
+        results.append({'query' : name, 'baseline_secs' : baseline, 'indexed_secs' : indexed,
+                        'speedup' : baseline / indexed})
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    path = os.getcwd()
+    conn = sqlite3.connect(f'{path}/TLC_trips.sqlite')
+    create_query_indexes(conn)
+    refresh_rollups(conn)
+
+    # the busiest pickup station in the last year of rides
+    last_hour = conn.execute('SELECT MAX(ride_datetime) FROM pickup_trips;').fetchone()[0]
+    end = pd.Timestamp(last_hour).normalize() + pd.Timedelta(days=1)
+    start = end - pd.DateOffset(years=1)
+    station = top_zones(conn, start, end, 1).pickup_station.iloc[0]
+
+    print(f'Station {station} from {start:%Y-%m-%d} to {end:%Y-%m-%d}\n')
+    print(benchmark_queries(conn, station, start, end).round(4).to_string(index=False))
+    conn.close()
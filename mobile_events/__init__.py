@@ -0,0 +1,14 @@
+"""
+Mobility analysis of mobile events: user stays in H3 grid areas and popular areas in the UAE
+
+Run the pipeline with `python -m mobile_events --help`. Plotting and map modules
+(seaborn, folium) are only imported by the stages that use them.
+"""
+from .geo import CellGeometry, assign_cells, calculate_distance, calculate_user_distances
+from .stays import (GULF_STANDARD_TIME, TRANSPORT_MODE_BINS, add_stay_features, aggregate_user_stays,
+                    assign_transportation_mode, compact_user_stays, continue_user_events, count_midnights,
+                    local_times, mark_user_stays, memory_usage_mb, obtain_user_stays, read_event_chunks,
+                    stream_user_stays)
+from .incremental import update_user_stays
+from .parallel import parallel_user_stays
+from .spatial import StayIndex
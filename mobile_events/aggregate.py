@@ -0,0 +1,181 @@
+"""
+Area-level aggregates of user stays (popularity, distances, durations and location names)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def get_location_names(grid_areas, cache_file='area_location_names.parquet'):
+    """
+    Reverse Geocodes the centres of grid areas in one batch
+    Names are cached on disk by grid area (H3 cell ID) so only new areas are geocoded
+    Returns a dictionary of grid area and its (name, administration)
+    """
+    import reverse_geocoder as rg
+
+    if os.path.exists(cache_file):
+        location_names = pd.read_parquet(cache_file)
+    else:
+        location_names = pd.DataFrame({'area' : pd.Series(dtype=np.uint64),
+                                       'name' : pd.Series(dtype=object),
+                                       'admin' : pd.Series(dtype=object)})
+
+    new_areas = grid_areas[~grid_areas.area.isin(location_names.area)]
+    if len(new_areas) > 0:
+        coordinates = list(zip(new_areas.center_lat, new_areas.center_lon))
+        results = rg.search(coordinates, mode=1, verbose=False) # local KD-tree, no rate limit
+        new_names = pd.DataFrame({'area' : new_areas.area.values,
+                                  'name' : [res['name'] for res in results],
+                                  'admin' : [res['admin1'] for res in results]})
+        location_names = pd.concat([location_names, new_names], ignore_index=True)
+        location_names.to_parquet(cache_file, index=False)
+
+    location_names = location_names[location_names.area.isin(grid_areas.area)]
+    return dict(zip(location_names.area, zip(location_names.name, location_names.admin)))
+
+
+# keys of the area cube (the hour stays ended, the day of week of their start and whether it is a weekend
+# and overnight stays), the centres follow from area
+AREA_CUBE_KEYS = ['area', 'center_lat', 'center_lon', 'end_hour', 'dow', 'is_weekend', 'is_overnight']
+
+
+def build_area_cube(user_stays):
+    """
+    Aggregates user stays once into a cube of stay counts and total distances and durations by
+    grid area, end hour, day of week (weekend) and overnight stay.
+    Area statistics, hourly stays and plots by time are sums over slices of the cube.
+    """
+    return user_stays.groupby(AREA_CUBE_KEYS, observed=True, sort=True).agg(
+        stays = ('distances', 'size'),
+        distances = ('distances', 'sum'),
+        duration = ('duration', 'sum')
+    ).reset_index()
+
+
+def daily_area_stays(user_stays):
+    """
+    Counts stays in every grid area by start date (for the average daily stays of areas)
+    """
+    return user_stays.groupby(['area', 'start_date'], sort=True).size().reset_index(name='stays')
+
+
+def area_mode_stays(user_stays):
+    """
+    Counts stays in every grid area by transport mode (for the most frequent mode of areas)
+    """
+    return user_stays.groupby(['area', 'transport_mode'], observed=True, sort=True).size().reset_index(name='stays')
+
+
+def aggregate_areas(area_cube, daily_stays, mode_stays, area_names=None, top_n=10):
+    """
+    Aggregates user stays in every grid area from the area cube (see build_area_cube) and the
+    daily and transport mode stays of areas (see daily_area_stays and area_mode_stays)
+    Returns the centre, mean distance and duration, most frequent transport mode, stay counts
+    (all, overnight and weekend), average daily stays and location name of each grid area
+    and flags the top_n areas by stays
+    """
+    grouped = area_cube.groupby('area')
+    area_stats = grouped.agg(
+        center_lat = ('center_lat', 'first'),
+        center_lon = ('center_lon', 'first'),
+        distance = ('distances', 'sum'),
+        duration = ('duration', 'sum'),
+        stay_counts = ('stays', 'sum')
+    )
+    area_stats['distance'] /= area_stats.stay_counts
+    area_stats['duration'] /= area_stats.stay_counts
+
+    # most frequent transport mode (the first mode by name on ties, as Series.mode of mode names)
+    mode_counts = mode_stays.assign(transport_mode = mode_stays.transport_mode.astype(str)).sort_values(
+        ['area', 'stays', 'transport_mode'], ascending=[True, False, True])
+    area_modes = mode_counts.drop_duplicates('area').set_index('area').transport_mode
+    area_stats['transport_mode'] = area_modes.reindex(area_stats.index)
+
+    area_stats['overnight_counts'] = area_cube.query('is_overnight == 1').groupby('area').stays.sum().reindex(
+        area_stats.index, fill_value=0)
+    area_stats['weekend_counts'] = area_cube.query('is_weekend == 1').groupby('area').stays.sum().reindex(
+        area_stats.index, fill_value=0)
+
+    # average stay per day (Daily stays)
+    area_stats['avg_daily_stays'] = daily_stays.groupby('area').stays.mean().round(2)
+
+    area_stats['is_top_stay'] = area_stats.index.isin(area_stats.stay_counts.nlargest(top_n).index)
+    area_stats = area_stats.reset_index()
+
+    names = [(area_names or {}).get(area, (np.nan, np.nan)) for area in area_stats.area]
+    return area_stats.assign(name = [name[0] for name in names], admin = [name[1] for name in names])
+
+
+def hourly_area_stays(area_cube):
+    """
+    Counts stays in every grid area by the hour stays ended (from the area cube)
+    """
+    return area_cube.groupby(['end_hour', 'area']).agg(
+        hourly_stays = ('stays', 'sum'),
+        center_lat = ('center_lat', 'first'),
+        center_lon = ('center_lon', 'first')
+    ).reset_index()
+
+
+def time_of_day_buckets(times, minutes=60):
+    """
+    Bucket codes of the time of day in slots of minutes (e.g. 0-95 for 15 minute slots)
+    """
+    times = pd.Series(times)
+    return ((times.dt.hour * 60 + times.dt.minute) // minutes).to_numpy()
+
+
+def day_hour_buckets(dow, hours):
+    """
+    Bucket codes of the day of week (1-7) and hour of day (0-167)
+    """
+    return (np.asarray(dow, dtype=int) - 1) * 24 + np.asarray(hours, dtype=int)
+
+
+def bucket_area_stays(stays, buckets, weight=None):
+    """
+    Counts stays in every grid area by time bucket
+    stays : user stays or the area cube (with weight='stays') with area and centre columns
+    buckets : bucket code of every row (see time_of_day_buckets and day_hour_buckets)
+    """
+    stays = stays.assign(bucket = buckets)
+    grouped = stays.groupby(['bucket', 'area'])
+    return grouped.agg(
+        stays = (weight, 'sum') if weight else ('area', 'size'),
+        center_lat = ('center_lat', 'first'),
+        center_lon = ('center_lon', 'first')
+    ).reset_index()
+
+
+def heatmap_frames(data, bucket, weight, buckets=None, columns=('center_lat', 'center_lon')):
+    """
+    Returns the [latitude, longitude, weight] of rows for every time bucket (HeatMapWithTime data)
+    in one pass: rows are sorted by bucket once and split at the bucket boundaries
+
+    data : DataFrame with bucket codes, centre coordinates and weights
+    buckets : bucket codes of the frames in order (the buckets in data if None),
+              buckets without rows get empty frames
+    Returns one frame per unique bucket (no frames without buckets)
+    """
+    data = data.sort_values(bucket, kind='stable')
+    codes = data[bucket].to_numpy()
+    # unique buckets in order, so frames match the bucket labels one to one
+    buckets = np.unique(codes if buckets is None else np.asarray(buckets))
+    if len(buckets) == 0:
+        return []
+    keep = np.isin(codes, buckets)
+    codes = codes[keep]
+    values = data[[*columns, weight]].to_numpy(dtype=float)[keep]
+
+    # start of every bucket in the sorted rows
+    boundaries = np.searchsorted(codes, buckets[1:], side='left')
+    return [frame.tolist() for frame in np.split(values, boundaries)]
+
+
+def hourly_heatmap_data(hourly_stays):
+    """
+    Returns the [latitude, longitude, stays] of grid areas for every hour of the day
+    """
+    return heatmap_frames(hourly_stays, 'end_hour', 'hourly_stays', buckets=range(24))
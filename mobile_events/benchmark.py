@@ -0,0 +1,254 @@
+"""
+Benchmarks of the mobility pipeline on synthetic UAE GPS traces
+
+    python -m mobile_events.benchmark --users 1000 --events 1000 --output benchmark.json
+
+Every stage is timed on the same generated events. The throughput (events/s) of a stage is the
+number of input events over its run time, the peak RSS is the peak of the process so far.
+Results are written as JSON to compare runs across versions.
+
+With --compare-groupby, the fused aggregation of marked records into stays (aggregate_user_stays)
+is also timed against the groupby and merge aggregation it replaced, e.g. on 10M events:
+
+    python -m mobile_events.benchmark --users 10000 --events 1000 --stages stays --compare-groupby
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import (aggregate_areas, area_mode_stays, build_area_cube, daily_area_stays, hourly_area_stays,
+                        hourly_heatmap_data)
+from .geo import CellGeometry, assign_cells, calculate_user_distances
+from .ingest import add_event_features, add_time_features
+from .stays import aggregate_user_stays, assign_transportation_mode, mark_user_stays, obtain_user_stays
+
+
+# city centres (latitude, longitude) that users live around
+UAE_CITIES = {
+    'Abu Dhabi' : (24.45, 54.38),
+    'Dubai' : (25.20, 55.27),
+    'Sharjah' : (25.35, 55.42),
+    'Ajman' : (25.41, 55.51),
+    'Al Ain' : (24.21, 55.74),
+    'Ras Al Khaimah' : (25.79, 55.94),
+    'Fujairah' : (25.13, 56.33)
+}
+UAE_BOUNDS = dict(location=(24.0, 54.0), min_lat=22.6, max_lat=26.1, min_lon=51.5, max_lon=56.4)
+
+BENCHMARK_STAGES = ['distances', 'cells', 'event_features', 'stays', 'aggregate', 'heatmap', 'maps']
+
+
+def generate_events(n_users=1000, n_events=100, n_places=5, start='2023-11-01', seed=0):
+    """
+    Generates GPS traces of n_users with n_events each within the UAE
+    Every user visits n_places places around a city (moving with a probability of 0.3 between
+    events) with GPS noise of about 50 m and exponential gaps (mean 30 minutes) between events
+    """
+    rng = np.random.default_rng(seed)
+    cities = np.array(list(UAE_CITIES.values()))
+    user_cities = cities[rng.integers(len(cities), size=n_users)]
+    places = user_cities[:, None, :] + rng.normal(scale=0.08, size=(n_users, n_places, 2))
+
+    # place of every event: a new random place at moves, the last place otherwise
+    moves = rng.random((n_users, n_events)) < 0.3
+    moves[:, 0] = True
+    new_places = rng.integers(n_places, size=(n_users, n_events))
+    last_move = np.maximum.accumulate(np.where(moves, np.arange(n_events), 0), axis=1)
+    event_places = np.take_along_axis(new_places, last_move, axis=1)
+
+    coordinates = places[np.arange(n_users)[:, None], event_places]
+    coordinates = coordinates + rng.normal(scale=0.0005, size=coordinates.shape)
+
+    gaps = rng.exponential(30*60, size=(n_users, n_events))
+    gaps[:, 0] = rng.uniform(0, 24*60*60, size=n_users)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(np.cumsum(gaps, axis=1).ravel().round(), unit='s')
+
+    return pd.DataFrame({
+        'user_id' : np.repeat(np.arange(n_users, dtype=np.int32), n_events),
+        'timestamp' : timestamps.astype('datetime64[ns]'),
+        'latitude' : np.clip(coordinates[..., 0].ravel(), UAE_BOUNDS['min_lat'], UAE_BOUNDS['max_lat']),
+        'longitude' : np.clip(coordinates[..., 1].ravel(), UAE_BOUNDS['min_lon'], UAE_BOUNDS['max_lon'])
+    })
+
+
+def groupby_user_stays(df_copy):
+    """
+    Aggregates marked user records into stays with three groupbys on (user_id, stay_id, area) and
+    merges of stay starts and ends (the aggregation before aggregate_user_stays, kept as its baseline)
+    """
+    # get stay records and distances for each user's stays ID in every grid area
+    stay_records = df_copy.groupby(['user_id', 'stay_id', 'area']).size()
+    stay_records.name = 'n_records_in_stay'
+    stay_records = stay_records.reset_index()
+
+    stay_distances = df_copy.groupby(['user_id', 'stay_id', 'area']).distances.sum()
+
+    stay_durations = df_copy.groupby(['user_id', 'stay_id', 'area']).duration.sum()
+
+    # filter out rows with stay start and end values as True
+    stay_start = df_copy.query('stay_start == 1')[['user_id', 'start_time', 'area', 'stay_id']]
+    stay_end = df_copy.query('stay_end == True')[['user_id', 'timestamp', 'area', 'stay_id']].rename(
+        columns={'timestamp':'end_time'})
+    user_stays = pd.merge(stay_start, stay_end, on=['user_id', 'area', 'stay_id'], how='inner')
+    user_stays = user_stays.merge(stay_durations, on = ['user_id', 'stay_id', 'area'], how='inner')
+    user_stays = user_stays.merge(stay_records, on = ['user_id', 'stay_id', 'area'], how='inner')
+    user_stays = user_stays.merge(stay_distances, on = ['user_id', 'stay_id', 'area'], how='inner')
+    return user_stays
+
+
+def same_stays(user_stays, other_stays):
+    """
+    Whether two aggregations have the same stays (in any order, sums equal up to float rounding)
+    """
+    keys = ['user_id', 'stay_id', 'area']
+    try:
+        pd.testing.assert_frame_equal(user_stays.sort_values(keys).reset_index(drop=True),
+                                      other_stays[user_stays.columns].sort_values(keys).reset_index(drop=True),
+                                      check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process (MB)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if platform.system() == 'Darwin' else peak / 2**10
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(n_users=1000, n_events=100, resolution=8, threshold=15*60, stages=BENCHMARK_STAGES, seed=0,
+                  compare_groupby=False):
+    """
+    Times the pipeline stages on generated events and returns the results as a dictionary
+    compare_groupby : also time the fused stay aggregation against the groupby and merge aggregation
+    """
+    events = add_time_features(generate_events(n_users, n_events, seed=seed))
+    n_total = len(events)
+    cell_geometry = CellGeometry()
+    results = []
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        output = func()
+        seconds = time.perf_counter() - start
+        events_per_second = round(n_total / seconds) if seconds > 0 else None
+        results.append({'stage' : stage, 'seconds' : round(seconds, 4), 'events_per_second' : events_per_second,
+                        'peak_rss_mb' : round(peak_rss_mb(), 1)})
+        throughput = f'{events_per_second:14,}' if events_per_second is not None else f'{"-":>14}'
+        print(f'{stage:15s} {seconds:8.3f} s {throughput} events/s')
+        return output
+
+    if 'distances' in stages:
+        timed('distances', lambda: calculate_user_distances(events))
+    if 'cells' in stages:
+        timed('cells', lambda: assign_cells(events.latitude.values, events.longitude.values, resolution))
+
+    # later stages need the outputs of earlier ones
+    events = timed('event_features', lambda: add_event_features(events, resolution))
+
+    stay_aggregation = None
+    if compare_groupby:
+        marked = mark_user_stays(events, threshold)
+        groupby_stays = timed('stays_groupby', lambda: groupby_user_stays(marked))
+        fused_stays = timed('stays_fused', lambda: aggregate_user_stays(marked))
+        groupby_seconds, fused_seconds = results[-2]['seconds'], results[-1]['seconds']
+        stay_aggregation = {'groupby_seconds' : groupby_seconds, 'fused_seconds' : fused_seconds,
+                            'speedup' : round(groupby_seconds / fused_seconds, 2) if fused_seconds > 0 else None,
+                            'same_stays' : same_stays(fused_stays, groupby_stays)}
+        print(f'fused stays {stay_aggregation["speedup"]}x faster than groupby, '
+              f'same stays: {stay_aggregation["same_stays"]}')
+        del marked, groupby_stays, fused_stays
+
+    def stays():
+        user_stays = obtain_user_stays(events, threshold, cell_geometry)
+        user_stays['transport_mode'] = assign_transportation_mode(user_stays.ave_speed_kmh)
+        return user_stays
+    user_stays = timed('stays', stays)
+
+    def aggregate():
+        area_cube = build_area_cube(user_stays)
+        area_stats = aggregate_areas(area_cube, daily_area_stays(user_stays), area_mode_stays(user_stays))
+        return area_stats, hourly_area_stays(area_cube)
+    area_stats, hourly_stays = timed('aggregate', aggregate)
+
+    if 'heatmap' in stages:
+        timed('heatmap', lambda: hourly_heatmap_data(hourly_stays))
+    if 'maps' in stages:
+        from . import maps
+
+        def render_maps():
+            for r in [maps.plot_area_popularity(area_stats, cell_geometry, UAE_BOUNDS),
+                      maps.plot_area_distance(area_stats, cell_geometry, UAE_BOUNDS),
+                      maps.plot_area_popularity_overtime(hourly_stays, hourly_heatmap_data(hourly_stays),
+                                                         cell_geometry, UAE_BOUNDS)]:
+                r.get_root().render()
+        timed('maps', render_maps)
+
+    return {
+        'version' : git_version(),
+        'python' : platform.python_version(),
+        'pandas' : pd.__version__,
+        'numpy' : np.__version__,
+        'n_users' : n_users,
+        'n_events_per_user' : n_events,
+        'n_events' : n_total,
+        'n_stays' : len(user_stays),
+        'n_areas' : len(area_stats),
+        'resolution' : resolution,
+        'threshold' : threshold,
+        'seed' : seed,
+        'stages' : results,
+        'stay_aggregation' : stay_aggregation
+    }
+
+
+def parse_stages(stages):
+    stages = [stage.strip() for stage in stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in BENCHMARK_STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown stages {unknown}, choose from {BENCHMARK_STAGES}')
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the mobility pipeline on synthetic UAE events')
+    parser.add_argument('--users', type=int, default=1000, help='number of users')
+    parser.add_argument('--events', type=int, default=100, help='number of events per user')
+    parser.add_argument('--resolution', type=int, default=8, help='H3 resolution of grid areas')
+    parser.add_argument('--threshold', type=float, default=15*60,
+                        help='minimum duration (in seconds) before a record to mark a stay')
+    parser.add_argument('--stages', type=parse_stages, default=BENCHMARK_STAGES,
+                        help=f'comma separated stages to time (default: {",".join(BENCHMARK_STAGES)})')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the event generator')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--compare-groupby', action='store_true',
+                        help='also time the fused stay aggregation against the groupby and merge aggregation')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.users, args.events, args.resolution, args.threshold,
+                            args.stages, args.seed, args.compare_groupby)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to', args.output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
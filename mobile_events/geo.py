@@ -0,0 +1,151 @@
+"""
+Distances and H3 grid areas of mobile event coordinates
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from h3.api import basic_int as h3_int
+
+
+def calculate_distance(loc1, loc2, unit='km'):
+    """
+    Calculates the Harversine Distance between two points
+    loc1|loc2 : (longitude, latitude)
+    """
+    R = 6371.0 # in KM
+    if not isinstance(loc1, list) or not isinstance(loc2, list):
+        loc1, loc2 = map(list, (loc1, loc2))
+    loc1, loc2 = map(np.deg2rad, [loc1, loc2])
+    loc_diff = loc2 - loc1
+    lat1, lon1 = loc1[1], loc1[0]
+    lat2, lon2 = loc2[1], loc2[0]
+    lat_d, lon_d = loc_diff[1], loc_diff[0]
+
+    a = (np.sin(lat_d/2)**2) + np.cos(lat1) * np.cos(lat2) * (np.sin(lon_d/2)**2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+    distance = c * R
+
+    if unit in ['m', 'meters']:
+        return distance * 1000
+    else:
+        return distance
+
+
+def calculate_user_distances(df, unit='km'):
+    """
+    Calculates the Harversine Distance between consecutive records of each user in a single pass
+    df : data sorted by user_id and timestamp (with longitude and latitude columns)
+    Returns an array of distances with 0 at the starting point of every user
+    """
+    user_ids = df.user_id.values
+    longitudes = df.longitude.values
+    latitudes = df.latitude.values
+
+    distances = np.zeros(len(df))
+    if len(df) < 2:
+        return distances
+
+    # distance from each record to the next (shifted arrays)
+    loc1 = [longitudes[:-1], latitudes[:-1]]
+    loc2 = [longitudes[1:], latitudes[1:]]
+    consecutive_distances = calculate_distance(loc1, loc2, unit=unit)
+
+    # set distance to 0 where a new user starts
+    same_user = user_ids[1:] == user_ids[:-1]
+    distances[1:] = np.where(same_user, consecutive_distances, 0)
+    return distances
+
+
+def assign_cells(latitudes, longitudes, resolutions=8):
+    """
+    Assigns H3 grid cells to coordinates and returns integer cell IDs
+    Repeated coordinates are deduplicated before calling into H3
+    latitudes|longitudes : arrays of coordinates
+    resolutions : H3 resolution or list of resolutions, e.g. [7, 8, 9]
+    Returns a dictionary of cell ID arrays (uint64) keyed by resolution
+    """
+    if isinstance(resolutions, (int, np.integer)):
+        resolutions = [resolutions]
+    coords = np.column_stack([np.asarray(latitudes, dtype=np.float64),
+                              np.asarray(longitudes, dtype=np.float64)])
+    # only look up each distinct coordinate once
+    unique_coords, inverse = np.unique(coords, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    cells = {}
+    for res in resolutions:
+        unique_cells = np.fromiter((h3_int.latlng_to_cell(lat, lon, res) for lat, lon in unique_coords),
+                                   dtype=np.uint64, count=len(unique_coords))
+        cells[res] = unique_cells[inverse]
+    return cells
+
+
+class CellGeometry:
+    """
+    Centres, boundaries and areas (km2) of H3 grid areas keyed by cell ID and resolution
+    Geometries are computed once per grid area and saved to a Parquet file (if given)
+    so that every map and aggregation reuses them
+    """
+    columns = ['area', 'resolution', 'center_lat', 'center_lon', 'boundary_lat', 'boundary_lon', 'area_km2']
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        if cache_file is not None and os.path.exists(cache_file):
+            self.cells = pd.read_parquet(cache_file)
+        else:
+            self.cells = pd.DataFrame({col : pd.Series(dtype=object) for col in self.columns})
+            self.cells = self.cells.astype({'area' : np.uint64, 'resolution' : np.int8, 'center_lat' : float,
+                                            'center_lon' : float, 'area_km2' : float})
+        self._positions = pd.Index(self.cells.area)
+
+    def add(self, areas):
+        """
+        Computes and stores the geometry of grid areas that are not cached yet
+        """
+        areas = pd.unique(np.asarray(areas, dtype=np.uint64))
+        new_areas = areas[~np.isin(areas, self.cells.area.values)]
+        if len(new_areas) == 0:
+            return self
+
+        cells = [int(area) for area in new_areas]
+        centres = np.array([h3_int.cell_to_latlng(cell) for cell in cells]).reshape(-1, 2)
+        boundaries = [np.array(h3_int.cell_to_boundary(cell)) for cell in cells]
+        new_cells = pd.DataFrame({
+            'area' : new_areas,
+            'resolution' : np.array([h3_int.get_resolution(cell) for cell in cells], dtype=np.int8),
+            'center_lat' : centres[:, 0],
+            'center_lon' : centres[:, 1],
+            'boundary_lat' : [boundary[:, 0] for boundary in boundaries],
+            'boundary_lon' : [boundary[:, 1] for boundary in boundaries],
+            'area_km2' : [h3_int.cell_area(cell, unit='km^2') for cell in cells]
+        })
+        self.cells = new_cells if len(self.cells) == 0 else pd.concat([self.cells, new_cells], ignore_index=True)
+        self._positions = pd.Index(self.cells.area)
+
+        if self.cache_file is not None:
+            self.cells.to_parquet(self.cache_file, index=False)
+        return self
+
+    def grid_areas(self, areas, columns=('center_lat', 'center_lon')):
+        """
+        Returns the unique grid areas with the latitude and longitude of their centres (and other columns)
+        """
+        areas = pd.unique(np.asarray(areas, dtype=np.uint64))
+        self.add(areas)
+        cells = self.cells.iloc[self._positions.get_indexer(areas)]
+        return cells[['area', *columns]].reset_index(drop=True)
+
+    def boundary(self, area):
+        """
+        Returns the GeoJSON polygon coordinates (longitude, latitude) of a grid area
+        (add the geometries of many grid areas at once first, every added area rewrites the cache file)
+        """
+        if area not in self._positions:
+            self.add([area])
+        position = self._positions.get_loc(area)
+        lats = self.cells.boundary_lat.iloc[position]
+        lons = self.cells.boundary_lon.iloc[position]
+        boundary = [[lon, lat] for lat, lon in zip(lats, lons)]
+        return [boundary + boundary[:1]]
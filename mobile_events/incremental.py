@@ -0,0 +1,112 @@
+"""
+Incremental (append-only) stay detection for new drops of mobile events, e.g. daily files
+
+A checkpoint keeps the last event and the records of the open (last) stay of every user.
+New events continue from the checkpoint, so only new and updated stays are computed and
+written to the user stays dataset (one Parquet file per stay start date).
+"""
+import os
+
+import pandas as pd
+
+from .geo import CellGeometry, assign_cells
+from .ingest import EVENT_COLUMNS
+from .stays import (LAST_EVENT_COLUMNS, add_stay_features, aggregate_user_stays, assign_transportation_mode,
+                    compact_user_stays, continue_user_events, find_stay_ends, local_times)
+
+
+def load_checkpoint(checkpoint_dir):
+    """
+    Returns the last events and open stay records of users (None if there is no checkpoint yet)
+    """
+    last_events_file = os.path.join(checkpoint_dir, 'last_events.parquet')
+    open_stays_file = os.path.join(checkpoint_dir, 'open_stays.parquet')
+    if not os.path.exists(last_events_file):
+        return None, None
+    return pd.read_parquet(last_events_file), pd.read_parquet(open_stays_file)
+
+
+def save_checkpoint(checkpoint_dir, last_events, open_stays):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    last_events.to_parquet(os.path.join(checkpoint_dir, 'last_events.parquet'), index=False)
+    open_stays.to_parquet(os.path.join(checkpoint_dir, 'open_stays.parquet'), index=False)
+
+
+def write_user_stays(user_stays, stays_dir, replaced_stays=None):
+    """
+    Writes stays to the stays dataset (one file per start date), replacing earlier versions of the
+    same stays (user_id, stay_id) and removing replaced_stays (user_id, stay_id, start_date).
+    Only the files of the start dates of these stays are rewritten.
+    """
+    os.makedirs(stays_dir, exist_ok=True)
+    keys = ['user_id', 'stay_id', 'start_date']
+    removed = pd.concat([user_stays[keys], replaced_stays], ignore_index=True) \
+        if replaced_stays is not None else user_stays[keys]
+
+    for start_date, removed_stays in removed.groupby('start_date'):
+        filepath = os.path.join(stays_dir, f'{start_date:%Y-%m-%d}.parquet')
+        stays = user_stays[user_stays.start_date == start_date]
+        if os.path.exists(filepath):
+            existing = pd.read_parquet(filepath)
+            removed_keys = pd.MultiIndex.from_frame(removed_stays[['user_id', 'stay_id']])
+            is_removed = pd.MultiIndex.from_frame(existing[['user_id', 'stay_id']]).isin(removed_keys)
+            stays = pd.concat([existing[~is_removed], stays], ignore_index=True)
+        if len(stays) > 0:
+            stays.to_parquet(filepath, index=False)
+        elif os.path.exists(filepath):
+            os.remove(filepath)
+
+
+def update_user_stays(events, output_dir, threshold=15*60, resolution=8, cell_geometry=None, timezone=None):
+    """
+    Detects stays from new events and merges them into the stays dataset in output_dir/user_stays.
+    Events of every user must be later than the user's events in earlier updates.
+    Returns the new and updated stays.
+
+    events : DataFrame with user_id, timestamp, latitude and longitude columns
+    threshold : minimum duration (in seconds) before a record to mark a stay
+    cell_geometry : CellGeometry providing the centres of grid areas (computed in memory if None)
+    timezone : local timezone of time features, e.g. GULF_STANDARD_TIME (must be the same for every update)
+    """
+    if cell_geometry is None:
+        cell_geometry = CellGeometry()
+    checkpoint_dir = os.path.join(output_dir, 'checkpoint')
+    last_events, open_stays = load_checkpoint(checkpoint_dir)
+
+    events = events[EVENT_COLUMNS].sort_values(['user_id', 'timestamp'], kind='stable')
+    events['area'] = assign_cells(events.latitude.values, events.longitude.values, resolution)[resolution]
+    events = continue_user_events(events, last_events, threshold)
+
+    # continue the open stays of users with new events
+    users = events.user_id.unique()
+    records = events
+    replaced_stays = None
+    if open_stays is not None:
+        continued_stays = open_stays[open_stays.user_id.isin(users)]
+        records = pd.concat([continued_stays, events], ignore_index=True)
+        records = records.sort_values('user_id', kind='stable', ignore_index=True)
+
+        # earlier versions of continued stays are replaced (or removed if they no longer end in their area)
+        replaced_stays = continued_stays.query('stay_start == 1')
+        replaced_stays = replaced_stays.assign(
+            start_date = local_times(replaced_stays.start_time, timezone).dt.normalize())[
+            ['user_id', 'stay_id', 'start_date']]
+    records['stay_end'] = find_stay_ends(records)
+
+    user_stays = add_stay_features(aggregate_user_stays(records), timezone)
+    user_stays = user_stays.merge(cell_geometry.grid_areas(user_stays['area']), on=['area'])
+    user_stays['transport_mode'] = assign_transportation_mode(user_stays.ave_speed_kmh)
+    user_stays = compact_user_stays(user_stays)
+    write_user_stays(user_stays, os.path.join(output_dir, 'user_stays'), replaced_stays)
+
+    # checkpoint the last event and the records of the last stay of every user
+    new_last_events = events.groupby('user_id').tail(1)[LAST_EVENT_COLUMNS]
+    last_stay_id = records.groupby('user_id').stay_id.transform('max')
+    new_open_stays = records[(records.stay_id == last_stay_id) & (last_stay_id > 0)].drop(columns='stay_end')
+    if last_events is not None:
+        new_last_events = pd.concat([last_events[~last_events.user_id.isin(users)], new_last_events],
+                                    ignore_index=True)
+        new_open_stays = pd.concat([open_stays[~open_stays.user_id.isin(users)], new_open_stays],
+                                   ignore_index=True)
+    save_checkpoint(checkpoint_dir, new_last_events, new_open_stays)
+    return user_stays
@@ -0,0 +1,105 @@
+"""
+Loading and preparation of mobile events (user_id, timestamp, latitude, longitude)
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from .geo import assign_cells, calculate_user_distances
+
+
+EVENT_COLUMNS = ['user_id', 'timestamp', 'latitude', 'longitude']
+DAYNAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def event_schema(coordinate_dtype='float64'):
+    """
+    Arrow schema of mobile events (coordinate_dtype: float32 or float64)
+    """
+    coordinate_type = pa.float32() if coordinate_dtype == 'float32' else pa.float64()
+    return pa.schema([('user_id', pa.int32()),
+                      ('timestamp', pa.timestamp('ns')),
+                      ('latitude', coordinate_type),
+                      ('longitude', coordinate_type)])
+
+
+def utc_timestamps(timestamps):
+    """
+    Parses timestamps (ISO text or datetimes) as naive UTC datetimes
+    Timestamps with a zone (e.g. 2023-11-01T18:57:09.000Z or +04:00) are converted to UTC, naive ones are UTC
+    """
+    return pd.to_datetime(timestamps, utc=True, format='ISO8601').dt.tz_localize(None).astype('datetime64[ns]')
+
+
+def read_events(filepath, coordinate_dtype='float64'):
+    """
+    Reads mobile events with a typed schema from a CSV file or a (partitioned) Parquet file or directory
+    Timestamps are naive UTC (zone-aware timestamps are converted)
+    """
+    schema = event_schema(coordinate_dtype)
+    if os.path.isdir(filepath) or str(filepath).endswith('.parquet'):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(filepath, format='parquet', partitioning='hive')
+        # zone-aware timestamps are stored in UTC, so casting them drops the zone only
+        table = dataset.to_table(columns=EVENT_COLUMNS).cast(schema)
+    else:
+        from pyarrow import csv
+
+        convert_options = csv.ConvertOptions(column_types=schema, include_columns=EVENT_COLUMNS)
+        try:
+            table = csv.read_csv(filepath, convert_options=convert_options)
+        except pa.ArrowInvalid:
+            # timestamps with a zone are read as text and parsed
+            text_schema = schema.set(schema.get_field_index('timestamp'), pa.field('timestamp', pa.string()))
+            convert_options = csv.ConvertOptions(column_types=text_schema, include_columns=EVENT_COLUMNS)
+            data = csv.read_csv(filepath, convert_options=convert_options).to_pandas()
+            return data.assign(timestamp = utc_timestamps(data.timestamp))
+    return table.to_pandas()
+
+
+def add_time_features(data):
+    """
+    Extracts the date, day name (categorical ordered Mon to Sun) and hour (int8) of events
+    """
+    timestamps = data.timestamp.dt
+    return data.assign(date = timestamps.normalize(),
+                       dayname = pd.Categorical.from_codes(timestamps.dayofweek, categories=DAYNAMES, ordered=True),
+                       hour = timestamps.hour.astype('int8'))
+
+
+def load_events(filepath, coordinate_dtype='float64'):
+    """
+    Reads mobile events and extracts time/date related features
+    """
+    return add_time_features(read_events(filepath, coordinate_dtype))
+
+
+def add_event_features(data, resolution=8):
+    """
+    Sorts events by user and time and adds the day, duration and distance since the user's
+    previous event and the grid area (H3 cell ID) of every event
+    """
+    # sort by user ID and timestamp
+    data = data.sort_values(['user_id', 'timestamp'])
+
+    # get user day trips
+    data['day'] = (data.groupby(['user_id']).date.diff().dt.days.fillna(0) + 1).astype(int)
+    data['duration'] = data.groupby('user_id').timestamp.diff().dt.total_seconds().fillna(0)
+    data['distances'] = calculate_user_distances(data)
+
+    # assign grids
+    data['area'] = assign_cells(data.latitude.values, data.longitude.values, resolution)[resolution]
+    return data
+
+
+def summarise_events(data):
+    """
+    Prints a summary of the mobile events
+    """
+    print(f'Number of events: {len(data)} (duplicates: {data.duplicated().sum()})')
+    print('Time range:', data.timestamp.min(), '-', data.timestamp.max())
+    print('Number of users:', data.user_id.nunique())
+    print('Record day span:', (data.date.max() - data.date.min()).days + 1)
+    print('Number of grid areas:', data.area.nunique())
@@ -0,0 +1,180 @@
+"""
+Folium maps of mobile events and of the popularity of grid areas
+"""
+import folium
+import h3
+from folium import plugins
+
+
+def get_map_bounds(place='UAE'):
+    """
+    Geocodes a place and returns its centre and bounding box for maps
+    """
+    from geopy.geocoders import Nominatim
+
+    # get information about place
+    geolocator = Nominatim(user_agent=f'{place}_bbox')
+    location = geolocator.geocode(place)
+
+    # get bounding box
+    bbox = list(map(lambda x: float(x), location.raw['boundingbox']))
+    return dict(location=(location.latitude, location.longitude),
+                min_lat=bbox[0], max_lat=bbox[1], min_lon=bbox[2], max_lon=bbox[3])
+
+
+def create_map(bounds, zoom_start=7, title=None):
+    """
+    Creates a map restricted to the bounds (see get_map_bounds) with an optional title
+    """
+    r = folium.Map(tiles="CartoDB Voyager", zoom_start=zoom_start, max_bounds=True, **bounds)
+    if title is not None:
+        title_html = '''
+                 <h3 align="center" style="font-size:16px"><b>{}</b></h3>
+                 '''.format(title)
+        r.get_root().html.add_child(folium.Element(title_html))
+    return r
+
+
+def save_map(r, save_file, filename, default_filename):
+    """
+    Saves map as html if save_file else returns the map
+    """
+    if save_file:
+        if filename:
+            r.save(f'{filename}.html')
+        else:
+            r.save(f'{default_filename}.html')
+    else:
+        return r
+
+
+def grid_areas_to_geojson(properties, cell_geometry):
+    """
+    Builds a single GeoJSON FeatureCollection of grid areas (one feature per grid area)
+    properties : DataFrame with an area column and the properties shown for each grid area
+    cell_geometry : CellGeometry providing the boundaries of grid areas
+    """
+    # geometries of uncached grid areas are computed (and cached) at once, not one area at a time
+    cell_geometry.add(properties.area)
+    properties = properties.assign(grid_area = properties.area.map(h3.int_to_str))
+    feature_properties = properties.drop(columns='area').astype(object)
+    feature_properties = feature_properties.where(feature_properties.notna(), None).to_dict('records')
+
+    features = [
+        {
+            'type' : 'Feature',
+            'geometry' : {'type' : 'Polygon', 'coordinates' : cell_geometry.boundary(area)},
+            'properties' : props
+        }
+        for area, props in zip(properties.area, feature_properties)
+    ]
+    return {'type' : 'FeatureCollection', 'features' : features}
+
+
+def plot_events_heatmap(data, bounds, title=None, save_file=False, filename=None):
+    """
+    Heatmap of the locations of all mobile events
+    """
+    r = create_map(bounds, title=title)
+    r.add_child(plugins.HeatMap(data[['latitude', 'longitude']], radius=10))
+    return save_map(r, save_file, filename, 'events_heatmap')
+
+
+def plot_area_distance(area_stats, cell_geometry, bounds, title=None, save_file=False, filename=None):
+    """
+    Map of grid areas by the distance covered to stays (see aggregate_areas)
+    """
+    r = create_map(bounds, title=title)
+
+    heatmap_data = area_stats.query('(distance >= 100) | is_top_stay')
+
+    properties = area_stats.assign(
+        distance = area_stats.distance.round(2),
+        duration_hours = (area_stats.duration / 3600).round(2)
+    )[['area', 'stay_counts', 'distance', 'duration_hours', 'transport_mode', 'name', 'admin', 'is_top_stay']]
+
+    folium.GeoJson(
+        grid_areas_to_geojson(properties, cell_geometry),
+        style_function = lambda feature: {
+            'fillColor' : 'white',
+            'color' : 'transparent',
+            'weight': 0.1,
+            'fillOpacity' : 0.3 if feature['properties']['is_top_stay'] else 0
+        },
+        tooltip = folium.GeoJsonTooltip(
+            fields=['grid_area', 'stay_counts', 'distance', 'duration_hours', 'transport_mode', 'name', 'admin'],
+            aliases=['Grid Area', 'Stay counts', 'Total Distance (KM)', 'Average Duration (Hour)',
+                     'Frequent Transport mode', 'Name', 'Admin'])
+    ).add_to(r)
+    plugins.HeatMap(heatmap_data[['center_lat', 'center_lon', 'distance']],  radius=25).add_to(r)
+    return save_map(r, save_file, filename, 'area_stay_distances')
+
+
+def plot_area_popularity(area_stats, cell_geometry, bounds, title=None, save_file=False, filename=None):
+    """
+    Map of grid areas by the number of stays (see aggregate_areas)
+    """
+    r = create_map(bounds, title=title)
+
+    properties = area_stats[['area', 'stay_counts', 'overnight_counts', 'weekend_counts',
+                             'avg_daily_stays', 'name', 'admin']]
+
+    folium.GeoJson(
+        grid_areas_to_geojson(properties, cell_geometry),
+        style_function = lambda feature: {
+            'fillColor' : '#ff0000',
+            'color' : 'transparent',
+            'weight': 1,
+            'fillOpacity' : 0
+        },
+        tooltip = folium.GeoJsonTooltip(
+            fields=['grid_area', 'stay_counts', 'overnight_counts', 'weekend_counts', 'avg_daily_stays',
+                    'name', 'admin'],
+            aliases=['Grid Area', 'Stay count', 'Overnight counts', 'Weekend counts', 'Average Daily stays',
+                     'Name', 'Admin'])
+    ).add_to(r)
+    plugins.HeatMap(area_stats[['center_lat', 'center_lon', 'stay_counts']].query('stay_counts >= 40'),
+                    radius=15).add_to(r)
+    return save_map(r, save_file, filename, 'area_stay_popularity')
+
+
+def plot_area_popularity_overtime(hourly_stays, hourly_stays_list, cell_geometry, bounds,
+                                  title='Stays per hour of the day', save_file=False, filename=None,
+                                  index=None):
+    """
+    Map of grid areas by the number of stays at every hour of the day (see hourly_area_stays)
+    hourly_stays_list : heat map data of every time bucket (see heatmap_frames)
+    index : labels of the time buckets (hours of the day if None)
+    """
+    hour_map = create_map(bounds, zoom_start=8, title=title)
+
+    # one feature per grid area with the stay counts of every hour it has stays
+    area_hours = hourly_stays.sort_values(['area', 'end_hour'])
+    area_hours = area_hours.assign(
+        hour_counts = area_hours.end_hour.astype(str) + 'h: ' + area_hours.hourly_stays.astype(str))
+    properties = area_hours.groupby('area', sort=False).agg(
+        stay_counts = ('hourly_stays', 'sum'),
+        hourly_stays = ('hour_counts', ', '.join),
+        latitude = ('center_lat', 'first'),
+        longitude = ('center_lon', 'first')
+    ).round(4).reset_index()
+
+    folium.GeoJson(
+        grid_areas_to_geojson(properties, cell_geometry), overlay=False, show=True,
+        style_function = lambda feature: {
+            'fillColor' : '#ff0000',
+            'color' : 'transparent',
+            'weight': 0.7,
+            'fillOpacity' : 0
+        },
+        tooltip = folium.GeoJsonTooltip(
+            fields=['grid_area', 'stay_counts', 'hourly_stays', 'latitude', 'longitude'],
+            aliases=['Grid Area', 'Stay count', 'Stays by hour', 'Latitude', 'Longitude'])
+    ).add_to(hour_map)
+
+    index = list(range(24) if index is None else index)
+    if len(index) != len(hourly_stays_list):
+        raise ValueError(f'{len(hourly_stays_list)} heat map frames for {len(index)} time bucket labels')
+    plugins.HeatMapWithTime(hourly_stays_list, index=index, radius=20,
+                            auto_play=True, overlay=False, max_opacity=0.2, min_speed=2).add_to(hour_map)
+    return save_map(hour_map, save_file, filename, 'area_popularity_by_hour_of_day')
@@ -0,0 +1,87 @@
+"""
+Multi-process stay detection with events hash-partitioned by user
+
+Stays only depend on the events of the same user, so events are split into partitions of
+whole users, written as Arrow IPC files (memory-mapped by the workers) and processed in a
+ProcessPoolExecutor. Stays are concatenated in user order, as returned by obtain_user_stays.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from .geo import CellGeometry, assign_cells
+from .stays import add_stay_features, aggregate_user_stays, continue_user_events, find_stay_ends
+
+
+def partition_users(user_ids, n_partitions):
+    """
+    Returns the partition of every event by a hash of its user_id (the same for every run)
+    """
+    return (pd.util.hash_array(np.asarray(user_ids)) % n_partitions).astype(np.int32)
+
+
+def write_partitions(events, n_partitions, partition_dir):
+    """
+    Writes events hash-partitioned by user as uncompressed Arrow IPC files and returns their paths
+    """
+    partitions = partition_users(events.user_id.values, n_partitions)
+    filepaths = []
+    for partition in range(n_partitions):
+        partition_events = events[partitions == partition]
+        if len(partition_events) == 0:
+            continue
+        filepath = os.path.join(partition_dir, f'events_{partition}.arrow')
+        table = pa.Table.from_pandas(partition_events, preserve_index=False)
+        feather.write_feather(table, filepath, compression='uncompressed')
+        filepaths.append(filepath)
+    return filepaths
+
+
+def partition_stays(filepath, threshold=15*60, resolution=8, timezone=None):
+    """
+    Detects the stays (without grid area centres) of a partition of events
+    """
+    with pa.memory_map(filepath) as source:
+        events = pa.ipc.open_file(source).read_all().to_pandas()
+    events = events.sort_values(['user_id', 'timestamp'], kind='stable', ignore_index=True)
+    if 'area' not in events:
+        events['area'] = assign_cells(events.latitude.values, events.longitude.values, resolution)[resolution]
+
+    records = continue_user_events(events[['user_id', 'timestamp', 'latitude', 'longitude', 'area']],
+                                   threshold=threshold)
+    records['stay_end'] = find_stay_ends(records)
+    return add_stay_features(aggregate_user_stays(records), timezone)
+
+
+def parallel_user_stays(events, threshold=15*60, n_workers=None, n_partitions=None, resolution=8,
+                        cell_geometry=None, timezone=None):
+    """
+    Detects user stays like obtain_user_stays with the users split across worker processes
+
+    events : DataFrame with user_id, timestamp, latitude and longitude (and area) columns
+    n_workers : number of worker processes (all CPUs if None)
+    n_partitions : number of user partitions (4 per worker if None, to balance uneven users)
+    cell_geometry : CellGeometry providing the centres of grid areas (computed in memory if None)
+    timezone : local timezone of time features, e.g. GULF_STANDARD_TIME (times as recorded if None)
+    """
+    if cell_geometry is None:
+        cell_geometry = CellGeometry()
+    n_workers = n_workers or os.cpu_count()
+    n_partitions = n_partitions or 4 * n_workers
+    columns = [column for column in ['user_id', 'timestamp', 'latitude', 'longitude', 'area'] if column in events]
+
+    with tempfile.TemporaryDirectory(prefix='mobile_events_') as partition_dir:
+        filepaths = write_partitions(events[columns], n_partitions, partition_dir)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(partition_stays, filepaths, [threshold]*len(filepaths),
+                                        [resolution]*len(filepaths), [timezone]*len(filepaths)))
+
+    # stays of every partition are in user and time order, so a stable sort by user restores the order
+    user_stays = pd.concat(results, ignore_index=True).sort_values('user_id', kind='stable', ignore_index=True)
+    user_stays = user_stays.merge(cell_geometry.grid_areas(user_stays['area']), on=['area'])
+    return user_stays
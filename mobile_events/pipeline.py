@@ -0,0 +1,191 @@
+"""
+Command line pipeline of the mobile events analysis
+
+Stages (run in this order, select with --stages):
+    ingest     reads events, adds durations, distances and grid areas -> events.parquet
+    stays      detects user stays and their transport modes -> user_stays.parquet
+    aggregate  aggregates stays once into an area cube (and daily and transport mode stays of areas)
+               and slices it by grid area and hour
+               -> area_cube.parquet, area_days.parquet, area_modes.parquet, area_stats.parquet,
+                  hourly_stays.parquet
+    plots      shows exploratory plots of events and stays
+    maps       saves html maps of events and grid areas
+
+Stages read the outputs of earlier stages from the output directory when these were not run
+in the same call, e.g. `python -m mobile_events --stages maps` after a full run.
+
+With --incremental, the stays stage continues from the checkpoint of earlier runs and merges the
+stays of new events (e.g. a daily file) into the user_stays/ dataset (see incremental.py).
+With --workers N, the stays stage detects stays in N processes (see parallel.py).
+With --timezone (e.g. Asia/Dubai), time features of stays are in local time of UTC events.
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from .geo import CellGeometry
+
+
+STAGES = ['ingest', 'stays', 'aggregate', 'plots', 'maps']
+
+
+class Pipeline:
+    """
+    Runs pipeline stages and keeps their outputs in memory (reading saved outputs when missing)
+    """
+    def __init__(self, input_file, output_dir='.', threshold=15*60, resolution=8, incremental=False,
+                 n_workers=1, timezone=None):
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.resolution = resolution
+        self.incremental = incremental
+        self.n_workers = n_workers
+        self.timezone = timezone
+        self.cell_geometry = CellGeometry(self.path('cell_geometry.parquet'))
+        self.outputs = {}
+
+    def path(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def get(self, name):
+        """
+        Returns the output of an earlier stage (events, user_stays, area_cube, area_days, area_modes,
+        area_stats, hourly_stays)
+        """
+        if name not in self.outputs:
+            filepath = self.path(f'{name}.parquet')
+            if name == 'user_stays' and self.incremental:
+                filepath = self.path('user_stays')
+            if not os.path.exists(filepath):
+                raise FileNotFoundError(f'{filepath} not found, run the stage that creates {name} first')
+            self.outputs[name] = pd.read_parquet(filepath)
+        return self.outputs[name]
+
+    def save(self, name, df):
+        self.outputs[name] = df
+        df.to_parquet(self.path(f'{name}.parquet'), index=False)
+
+    def run(self, stages=STAGES):
+        for stage in STAGES:
+            if stage in stages:
+                print(f'Running {stage} stage')
+                getattr(self, f'run_{stage}')()
+
+    def run_ingest(self):
+        from .ingest import add_event_features, load_events, summarise_events
+
+        data = load_events(self.input_file)
+        data = add_event_features(data, self.resolution)
+        summarise_events(data)
+        self.save('events', data)
+
+    def run_stays(self):
+        from .stays import assign_transportation_mode, compact_user_stays, memory_usage_mb, obtain_user_stays
+
+        if self.incremental:
+            from .incremental import update_user_stays
+
+            user_stays = update_user_stays(self.get('events'), self.output_dir, self.threshold,
+                                           self.resolution, self.cell_geometry, self.timezone)
+            print('Number of new and updated stays:', len(user_stays))
+            self.outputs.pop('user_stays', None)
+            return
+
+        # obtaining significant stays based on threshold
+        if self.n_workers > 1:
+            from .parallel import parallel_user_stays
+
+            user_stays = parallel_user_stays(self.get('events'), self.threshold, self.n_workers,
+                                             resolution=self.resolution, cell_geometry=self.cell_geometry,
+                                             timezone=self.timezone)
+        else:
+            user_stays = obtain_user_stays(self.get('events'), self.threshold, self.cell_geometry, self.timezone)
+        user_stays['transport_mode'] = assign_transportation_mode(user_stays.ave_speed_kmh)
+        print('Number of stays:', len(user_stays))
+
+        # compact dtypes, user_stays is held in memory by all later stages
+        memory_before = memory_usage_mb(user_stays)
+        user_stays = compact_user_stays(user_stays)
+        print(f'Memory of stays: {memory_before:.2f} MB -> {memory_usage_mb(user_stays):.2f} MB')
+        self.save('user_stays', user_stays)
+
+    def run_aggregate(self):
+        from .aggregate import (aggregate_areas, area_mode_stays, build_area_cube, daily_area_stays,
+                                get_location_names, hourly_area_stays)
+
+        user_stays = self.get('user_stays')
+        # get location names of all grid areas
+        grid_areas = self.cell_geometry.grid_areas(user_stays['area'])
+        area_names = get_location_names(grid_areas, self.path('area_location_names.parquet'))
+
+        area_cube = build_area_cube(user_stays)
+        self.save('area_cube', area_cube)
+        self.save('area_days', daily_area_stays(user_stays))
+        self.save('area_modes', area_mode_stays(user_stays))
+        self.save('area_stats', aggregate_areas(area_cube, self.get('area_days'), self.get('area_modes'),
+                                                area_names))
+        self.save('hourly_stays', hourly_area_stays(area_cube))
+
+    def run_plots(self):
+        from . import plots
+
+        user_stays = self.get('user_stays')
+        area_cube = self.get('area_cube')
+        plots.plot_trip_durations(self.get('events'))
+        # distributions, start hours and modes by hour need the stays, counts by time are slices of the cube
+        print(plots.describe_stays(user_stays))
+        plots.plot_stay_distributions(user_stays)
+        plots.plot_stays_by_time(user_stays, area_cube)
+        plots.plot_transport_modes(user_stays)
+
+    def run_maps(self):
+        from .aggregate import hourly_heatmap_data
+        from . import maps
+
+        bounds = maps.get_map_bounds('UAE')
+        area_stats = self.get('area_stats')
+        hourly_stays = self.get('hourly_stays')
+
+        maps.plot_events_heatmap(self.get('events'), bounds, save_file=True,
+                                 filename=self.path('events_heatmap'))
+        maps.plot_area_popularity(area_stats, self.cell_geometry, bounds, title='Popular Areas in the UAE',
+                                  save_file=True, filename=self.path('area_stay_popularity'))
+        # area stay by total distance covered
+        maps.plot_area_distance(area_stats, self.cell_geometry, bounds, title='Area Stay total Distance',
+                                save_file=True, filename=self.path('area_stay_distances'))
+        maps.plot_area_popularity_overtime(hourly_stays, hourly_heatmap_data(hourly_stays),
+                                           self.cell_geometry, bounds, save_file=True,
+                                           filename=self.path('area_popularity_by_hour_of_day'))
+
+
+def parse_stages(stages):
+    stages = [stage.strip() for stage in stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown stages {unknown}, choose from {STAGES}')
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Detects user stays from mobile events and maps popular areas')
+    parser.add_argument('--input', default='mobile_events.csv', help='mobile events file')
+    parser.add_argument('--output-dir', default='.', help='directory of stage outputs')
+    parser.add_argument('--stages', type=parse_stages, default=STAGES,
+                        help=f'comma separated stages to run (default: {",".join(STAGES)})')
+    parser.add_argument('--threshold', type=float, default=15*60,
+                        help='minimum duration (in seconds) before a record to mark a stay')
+    parser.add_argument('--resolution', type=int, default=8, help='H3 resolution of grid areas')
+    parser.add_argument('--incremental', action='store_true',
+                        help='merge the stays of new events into the stays of earlier runs')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes detecting stays')
+    parser.add_argument('--timezone', default=None,
+                        help='local timezone of stay time features for UTC events, e.g. Asia/Dubai')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    pipeline = Pipeline(args.input, args.output_dir, args.threshold, args.resolution, args.incremental,
+                        args.workers, args.timezone)
+    pipeline.run(args.stages)
+    return pipeline
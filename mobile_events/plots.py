@@ -0,0 +1,144 @@
+"""
+Exploratory plots of mobile event durations and user stays
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+
+def plot_trip_durations(data):
+    """
+    Distribution of the duration between consecutive user records
+    """
+    # average user duration in mins (excluding 0 (start time))
+    mean_duration = data.query('duration != 0').duration.mean() / 60
+
+    # visualising user durations
+    plt.figure(figsize=(6,4))
+    sns.histplot(data.query('duration != 0').duration/60, alpha=0.8,
+                 color='indianred', bins=30, edgecolor='w', stat='percent')
+    plt.title('User Trip Duration', loc='left', fontdict=dict(fontsize=11, fontweight='bold'))
+    plt.axvline(mean_duration, linestyle='--', color='black', linewidth=0.8)
+    plt.annotate(f'Mean Duration: {mean_duration:.2f} mins',
+                 fontsize=8,
+                 xy=(mean_duration+100, 70),
+                 xytext=(mean_duration+1000, 80),
+                 arrowprops=dict(facecolor='black', arrowstyle='->',
+                                 connectionstyle = "arc, angleA = 0, angleB = 0, rad = 0")
+                 )
+    plt.xlabel('Trip Duration (In minutes)')
+    plt.show()
+
+    # Let's bin the duration into 7 groups: <1min, 1-5min (not inclusive), 5-10min, 10-15, 15-30, 30-60, >=1hour
+    duration_bins = pd.cut(data.duration, bins=[-np.inf, 60, 5*60, 10*60, 15*60, 30*60, 60*60, np.inf],
+                           right=False,
+                           labels=['<1min', '1-5min', '5-10min', '10-15min', '15-30min', '30-60min', '>=1hr'])
+
+    plt.figure()
+    sns.countplot(duration_bins, stat='proportion', color='steelblue')
+    plt.title('Duration Frequency Distribution', loc='left', fontsize=11, fontweight='bold')
+    plt.xlabel('Proportion'); plt.ylabel('')
+    plt.show()
+
+
+def describe_stays(user_stays):
+    """
+    Summary statistics (with skew, kurtosis and IQR) of stay durations, records, distances and speeds
+    """
+    cols = ['duration', 'n_records_in_stay', 'distances', 'ave_speed_kmh']
+    result = user_stays[cols].describe(percentiles=[0.25, 0.5, 0.75, 0.9, 0.95, 0.975, 0.99])
+    result.loc['skew', :] = user_stays[cols].skew().values
+    result.loc['kurt', :] = user_stays[cols].kurt().values
+    result.loc['IQR', :] = (user_stays[cols].quantile([0.25, 0.75]).diff().dropna() / 2).values
+    return result.T
+
+
+def plot_stay_distributions(user_stays):
+    """
+    Distribution of stay durations, records, distances and speeds
+    """
+    nrow, ncol = 2, 2
+    fig, ax = plt.subplots(nrow, ncol, figsize=(10,6))
+
+    cols = ['duration', 'n_records_in_stay', 'distances', 'ave_speed_kmh']
+    col_id = 0
+    for i in range(nrow):
+        for j in range(ncol):
+            mean_val = user_stays[cols[col_id]].mean()
+            sns.histplot(user_stays, x=cols[col_id], ax=ax[i,j], kde=False, stat='percent', bins=30)
+            ax[i, j].axvline(mean_val, linestyle='--', color='red', linewidth=0.9)
+            ax[i, j].set(xlabel='')
+            ax[i, j].set_title(cols[col_id].replace('_', ' ').title(), loc='left', fontsize=10)
+            ax[i, j].annotate(f'Mean {cols[col_id]}: {mean_val:,.2f}',
+                              fontsize=8, xy=(mean_val, 25), xytext=(mean_val+50, 60),
+                 arrowprops=dict(facecolor='black', arrowstyle='->',
+                                 connectionstyle = "arc, angleA = 0, angleB = 0, rad = 0")
+                 )
+            col_id += 1
+    fig.suptitle('Numerical Distribution', fontsize=11.2, fontweight='bold')
+    fig.tight_layout()
+    plt.show()
+
+
+def plot_stays_by_time(user_stays, area_cube):
+    """
+    Stays by hour of day, weekday/weekend and day of week (overnight stays) from the area cube
+    (start hours are not in the cube and are counted from user_stays)
+    """
+    fig, ax = plt.subplots(1,2,figsize=(10,4.5))
+    user_stays.start_hour.value_counts().sort_index().plot.bar(ax=ax[0],
+        rot=0, title='Stays by start hour', color='steelblue', xlabel='Hour', ylabel='Stay Counts')
+
+    area_cube.groupby('end_hour').stays.sum().plot.bar(ax=ax[1],
+        rot=0, title='Stays by end hour', color='steelblue', xlabel='Hour', ylabel='Stay Counts')
+    fig.tight_layout()
+    plt.show()
+
+    hourly_stays = area_cube.groupby(['end_hour', 'is_weekend'])[['stays', 'distances']].sum().reset_index()
+
+    # user stays per hour (by weekdays vs weekends)
+    plt.figure()
+    sns.lineplot(hourly_stays, x='end_hour', y='stays', hue='is_weekend')
+    plt.ylabel('Stays')
+    plt.xlabel('Hour of day')
+    plt.title('Number of Stays by hour by weekdays and weekends',
+              fontsize=10, fontweight='bold', loc='left')
+    plt.legend(title='Weekend')
+    plt.show()
+
+    # user distances per hour (by weekdays vs weekends)
+    plt.figure()
+    sns.lineplot(hourly_stays.assign(distances = hourly_stays.distances / hourly_stays.stays),
+                 x='end_hour', y='distances', hue='is_weekend')
+    plt.ylabel('Distances (KM)')
+    plt.xlabel('Hour of day')
+    plt.title('Average Distance by hour by weekdays and weekends', fontsize=10, fontweight='bold', loc='left')
+    plt.show()
+
+    # user stays by day of week by overnight stays
+    plt.figure(figsize=(8,4))
+    sns.barplot(area_cube.groupby(['dow', 'is_overnight']).stays.sum().reset_index(name='counts'),
+                 x='dow', y='counts', hue='is_overnight', dodge=False, width=0.6)
+    plt.ylabel('Stays')
+    plt.xlabel('Hour of day')
+    plt.title('Number of Overnight Stays by Day of week', fontsize=10, fontweight='bold', loc='left')
+    plt.xticks(range(7), ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+    plt.legend(title='Overnight', loc=(1.01, 0.48))
+    plt.show()
+
+
+def plot_transport_modes(user_stays):
+    """
+    Stays by end hour for every mode of transport (excluding stationary and anomalous speeds)
+    """
+    g = sns.catplot((
+        user_stays
+        .assign(transport_mode = user_stays.transport_mode.replace('Stat|Ano', np.nan, regex=True))
+        .dropna()
+        .assign(transport_mode = lambda x: x.transport_mode.cat.remove_unused_categories())
+        ), x='end_hour', hue='is_weekend', col='transport_mode', kind='count',
+            col_wrap=3, sharey=False, height=2.5, aspect=1.2, dodge=False)
+    g.set_xticklabels(range(0,24), fontsize=8)
+    g.tight_layout()
+    plt.show()
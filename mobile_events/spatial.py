@@ -0,0 +1,124 @@
+"""
+Radius and nearest-neighbour queries of user stays (or grid areas) around points
+
+Stays are located at the centre of their grid area (H3 cell), so queries look up the cells
+in a k-ring around the query point, measure the Haversine distance to the centres of the
+cells that have stays and return the stays of the matching cells.
+"""
+import numpy as np
+from h3.api import basic_int as h3_int
+
+from .geo import calculate_distance
+
+
+class StayIndex:
+    """
+    Index of user stays (or any rows with area, center_lat and center_lon columns, e.g. area_stats)
+    by grid area for batched radius and nearest-neighbour queries
+    All grid areas must have the same H3 resolution
+    """
+    def __init__(self, stays):
+        order = np.argsort(stays.area.values, kind='stable')
+        self.stays = stays.iloc[order].reset_index(drop=True)
+
+        # rows of the i-th grid area are stays[offsets[i]:offsets[i+1]]
+        self.areas, first_rows = np.unique(self.stays.area.values, return_index=True)
+        self.offsets = np.append(first_rows, len(self.stays))
+        self.center_lat = self.stays.center_lat.values[first_rows]
+        self.center_lon = self.stays.center_lon.values[first_rows]
+        self.resolution = h3_int.get_resolution(int(self.areas[0])) if len(self.areas) > 0 else None
+
+    def _ring_size(self, cell, radius_km):
+        """
+        Smallest k-ring around cell that contains all cells with centres within radius_km of a point in cell
+        """
+        # edge of a regular hexagon with the cell's area, cells in ring k are at least 1.5 * k edges away
+        edge = np.sqrt(2 * h3_int.cell_area(cell, unit='km^2') / (3 * np.sqrt(3)))
+        return int(np.ceil((radius_km + edge) / (1.5 * edge))) + 1
+
+    def _area_distances(self, latitude, longitude, radius_km):
+        """
+        Positions of grid areas (at least all areas within radius_km) and the distances to their centres
+        """
+        if len(self.areas) == 0:
+            return np.array([], dtype=int), np.array([], dtype=float)
+        cell = h3_int.latlng_to_cell(latitude, longitude, self.resolution)
+        k = self._ring_size(cell, radius_km)
+        if 3*k*(k + 1) + 1 < len(self.areas):
+            disk = np.array(h3_int.grid_disk(cell, k), dtype=np.uint64)
+            positions = np.searchsorted(self.areas, disk)
+            found = positions < len(self.areas)
+            found[found] = self.areas[positions[found]] == disk[found]
+            positions = positions[found]
+        else:
+            # the ring holds more cells than there are grid areas
+            positions = np.arange(len(self.areas))
+
+        points = [np.full(len(positions), longitude), np.full(len(positions), latitude)]
+        distances = calculate_distance(points, [self.center_lon[positions], self.center_lat[positions]])
+        return positions, distances
+
+    def _nearest_areas(self, latitude, longitude, n_areas):
+        """
+        Positions of the n_areas nearest grid areas and the distances to their centres
+        """
+        if n_areas <= 0 or len(self.areas) == 0:
+            return np.array([], dtype=int), np.array([], dtype=float)
+        cell = h3_int.latlng_to_cell(latitude, longitude, self.resolution)
+        radius_km = 0
+        while True:
+            positions, distances = self._area_distances(latitude, longitude, radius_km)
+            nearest = np.argsort(distances, kind='stable')[:n_areas]
+            if len(nearest) == min(n_areas, len(self.areas)):
+                # the ring searched must cover the distance to the last nearest area
+                max_distance = distances[nearest[-1]]
+                if self._ring_size(cell, max_distance) <= self._ring_size(cell, radius_km) \
+                        or len(positions) == len(self.areas):
+                    return positions[nearest], distances[nearest]
+                radius_km = max_distance
+            else:
+                # too few grid areas nearby, search a ring twice as wide
+                radius_km = max(2 * radius_km, 1.5 * np.sqrt(h3_int.cell_area(cell, unit='km^2')))
+
+    def _stay_rows(self, queries, positions, distances):
+        """
+        Stays of the matched grid areas with the index of the query and the distance (km) to the area centre
+        """
+        queries = np.asarray(queries, dtype=int)
+        positions = np.asarray(positions, dtype=int)
+        starts = self.offsets[positions]
+        counts = self.offsets[positions + 1] - starts
+        # rows starts[i], ..., starts[i] + counts[i] - 1 of every match
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        result = self.stays.iloc[rows].reset_index(drop=True)
+        return result.assign(query = np.repeat(queries, counts), distance_km = np.repeat(distances, counts))
+
+    def query_radius(self, latitudes, longitudes, radius_km):
+        """
+        Returns the stays within radius_km (Haversine distance to the grid area centre) of every point
+        with the index of the query point (query) and the distance (distance_km)
+        """
+        latitudes, longitudes = np.atleast_1d(latitudes), np.atleast_1d(longitudes)
+        queries, positions, distances = [], [], []
+        for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            area_positions, area_distances = self._area_distances(latitude, longitude, radius_km)
+            within = area_distances <= radius_km
+            queries.append(np.full(within.sum(), i))
+            positions.append(area_positions[within])
+            distances.append(area_distances[within])
+        return self._stay_rows(np.concatenate(queries), np.concatenate(positions), np.concatenate(distances))
+
+    def query_nearest(self, latitudes, longitudes, n_areas=1):
+        """
+        Returns the stays in the n_areas grid areas nearest to every point (ordered by distance)
+        with the index of the query point (query) and the distance (distance_km)
+        """
+        latitudes, longitudes = np.atleast_1d(latitudes), np.atleast_1d(longitudes)
+        queries, positions, distances = [], [], []
+        for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            area_positions, area_distances = self._nearest_areas(latitude, longitude, n_areas)
+            queries.append(np.full(len(area_positions), i))
+            positions.append(area_positions)
+            distances.append(area_distances)
+        return self._stay_rows(np.concatenate(queries), np.concatenate(positions), np.concatenate(distances))
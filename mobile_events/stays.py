@@ -0,0 +1,300 @@
+"""
+Detection of user stays from mobile events and the mode of transport used to get to them
+"""
+import numpy as np
+import pandas as pd
+
+from .geo import CellGeometry, assign_cells, calculate_user_distances
+from .ingest import EVENT_COLUMNS, utc_timestamps
+
+
+def mark_user_stays(df, threshold=15*60):
+    """
+    Marks the start, end and ID of user stays on records sorted by user_id and timestamp
+    """
+    df_copy = df.copy()
+    df_copy['is_stay'] = 1*(df_copy.duration >= threshold)
+    df_copy['stay_start'] = df_copy['is_stay'].astype(int) # start if is_stay
+    df_copy['stay_id'] = df_copy.groupby('user_id')['stay_start'].cumsum() # stay ID (increment for each user)
+    df_copy['start_time'] = df_copy.groupby('user_id').timestamp.shift(1) # time preceding stay occurrence
+    df_copy['stay_end'] = find_stay_ends(df_copy)
+    return df_copy
+
+
+def find_stay_ends(df):
+    """
+    Flags records where the user moves to a different area next (or the last record of the user)
+    """
+    areas = df.area.values
+    user_ids = df.user_id.values
+    stay_end = np.ones(len(df), dtype=bool) # last record is a stay end
+    stay_end[:-1] = (areas[1:] != areas[:-1]) | (user_ids[1:] != user_ids[:-1])
+    return stay_end
+
+
+def aggregate_user_stays(df_copy):
+    """
+    Aggregates marked user records into stays (one row per stay start and end in the same area)
+    Records must be sorted by user_id and timestamp, so each stay's records follow its start record
+    """
+    n = len(df_copy)
+    stay_ids = df_copy.stay_id.values
+    areas = df_copy.area.values
+
+    # position of the record that started the stay each record belongs to
+    stay_pos = np.where(df_copy.stay_start.values == 1, np.arange(n), -1)
+    stay_pos = np.maximum.accumulate(stay_pos) if n > 0 else stay_pos
+
+    # only records in the same area as the stay start are part of the stay
+    in_stay = stay_ids > 0
+    in_stay[in_stay] = areas[in_stay] == areas[stay_pos[in_stay]]
+    codes = stay_pos[in_stay]
+
+    # count, duration and distance of every stay in one reduction keyed by stay start position
+    n_records = np.bincount(codes, minlength=n)
+    durations = np.bincount(codes, weights=df_copy.duration.values[in_stay], minlength=n)
+    distances = np.bincount(codes, weights=df_copy.distances.values[in_stay], minlength=n)
+
+    # join stay ends to their stay start positionally
+    is_end = np.flatnonzero(in_stay & df_copy.stay_end.values)
+    start = stay_pos[is_end]
+    user_stays = pd.DataFrame({
+        'user_id' : df_copy.user_id.values[is_end],
+        'start_time' : df_copy.start_time.iloc[start].reset_index(drop=True),
+        'area' : areas[is_end],
+        'stay_id' : stay_ids[is_end],
+        'end_time' : df_copy.timestamp.iloc[is_end].reset_index(drop=True),
+        'duration' : durations[start],
+        'n_records_in_stay' : n_records[start],
+        'distances' : distances[start]
+    })
+    return user_stays
+
+
+# local timezone of the analysis (events are recorded in UTC)
+GULF_STANDARD_TIME = 'Asia/Dubai'
+
+
+def local_times(times, timezone=None):
+    """
+    Converts UTC timestamps (naive or timezone aware) to naive local times of timezone
+    (returned unchanged if timezone is None)
+    """
+    if timezone is None:
+        return times
+    if times.dt.tz is None:
+        times = times.dt.tz_localize('UTC')
+    return times.dt.tz_convert(timezone).dt.tz_localize(None)
+
+
+def count_midnights(start_times, end_times, timezone=None):
+    """
+    Number of (local) midnights crossed between start and end times, e.g. 1 from 22:00 to 07:00 the next day
+    """
+    start_dates = local_times(start_times, timezone).dt.normalize()
+    end_dates = local_times(end_times, timezone).dt.normalize()
+    return (end_dates - start_dates).dt.days
+
+
+def add_stay_features(user_stays, timezone=None):
+    """
+    Adds time related features and average speed to user stays
+    timezone : local timezone of time features, e.g. GULF_STANDARD_TIME (times as recorded if None)
+    """
+    start_times = local_times(user_stays.start_time, timezone)
+    end_times = local_times(user_stays.end_time, timezone)
+
+    # nights spent in stay (overnight if the stay ends after the midnight following its start)
+    n_nights = count_midnights(start_times, end_times)
+    user_stays = user_stays.assign(is_overnight = 1*(n_nights > 0), n_nights = n_nights)
+    user_stays['ave_speed_kmh'] = np.where(user_stays['duration'] == 0, 0, (user_stays['distances'] / user_stays['duration']) * 3600)
+    user_stays['start_hour'] = start_times.dt.hour
+    user_stays['end_hour'] = end_times.dt.hour
+    user_stays['dayname'] = start_times.dt.day_name().str[:3]
+    user_stays['dow'] = start_times.dt.isocalendar().day
+    user_stays['is_weekend'] = 1*(user_stays.dow >= 6)
+    user_stays['start_date'] = start_times.dt.normalize()
+    return user_stays
+
+
+def compact_user_stays(user_stays):
+    """
+    Converts user stays to compact dtypes: bool flags, small integers, ordered categorical day names
+    and transport modes, uint64 grid areas and timestamps in seconds
+    """
+    from .ingest import DAYNAMES
+
+    dtypes = {
+        'area' : np.uint64,
+        'stay_id' : np.int32,
+        'n_records_in_stay' : np.int32,
+        'n_nights' : np.int16,
+        'is_overnight' : bool,
+        'is_weekend' : bool,
+        'start_hour' : np.int8,
+        'end_hour' : np.int8,
+        'dow' : np.int8,
+        'dayname' : pd.CategoricalDtype(DAYNAMES, ordered=True),
+        'transport_mode' : 'category',
+        'start_time' : 'datetime64[s]',
+        'end_time' : 'datetime64[s]',
+        'start_date' : 'datetime64[s]'
+    }
+    return user_stays.astype({col : dtype for col, dtype in dtypes.items() if col in user_stays})
+
+
+def memory_usage_mb(df):
+    """
+    Memory used by a DataFrame (MB, including the contents of object columns)
+    """
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def obtain_user_stays(df, threshold=15*60, cell_geometry=None, timezone=None):
+    """
+    Aggregates user stays and returns significant stays based on selected thresholds
+    cell_geometry : CellGeometry providing the centres of grid areas (computed in memory if None)
+    timezone : local timezone of time features, e.g. GULF_STANDARD_TIME (times as recorded if None)
+    """
+    if cell_geometry is None:
+        cell_geometry = CellGeometry()
+    user_stays = aggregate_user_stays(mark_user_stays(df, threshold))
+    user_stays = add_stay_features(user_stays, timezone)
+
+    user_stays = user_stays.merge(cell_geometry.grid_areas(user_stays['area']), on=['area'])
+    return user_stays
+
+
+# columns carried over from the last event of a user to continue its stays
+LAST_EVENT_COLUMNS = ['user_id', 'timestamp', 'latitude', 'longitude', 'area', 'stay_id']
+
+
+def read_event_chunks(filepath, chunksize=1_000_000):
+    """
+    Reads mobile events from a CSV or Parquet file in chunks of rows
+    Timestamps are parsed as naive UTC, as by read_events
+    """
+    if str(filepath).endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(filepath)
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                                                            columns=EVENT_COLUMNS))
+    else:
+        chunks = pd.read_csv(filepath, usecols=EVENT_COLUMNS, chunksize=chunksize)
+    for chunk in chunks:
+        yield chunk.assign(timestamp = utc_timestamps(chunk['timestamp']))
+
+
+def continue_user_events(events, last_events=None, threshold=15*60):
+    """
+    Adds the duration and distance since the user's previous event, the start time and the stay ID
+    of events sorted by user_id and timestamp (with grid areas). Users with a last event
+    (user_id, timestamp, latitude, longitude, area, stay_id) seen before continue from it.
+    """
+    events = events.assign(is_carried = False)
+    if last_events is not None and len(last_events) > 0:
+        carried = last_events[last_events.user_id.isin(events.user_id.unique())]
+        # carried events come first for every user
+        events = pd.concat([carried.assign(is_carried = True), events], ignore_index=True)
+        events = events.sort_values('user_id', kind='stable', ignore_index=True)
+
+    user_ids = events.user_id.values
+    same_user = user_ids[1:] == user_ids[:-1]
+    time_diff = np.diff(events.timestamp.values)
+    if (user_ids[1:] < user_ids[:-1]).any() or (same_user & (time_diff < np.timedelta64(0))).any():
+        raise ValueError('events must be sorted by user_id and timestamp and later than the last events of users')
+
+    users = events.groupby('user_id')
+    events['duration'] = users.timestamp.diff().dt.total_seconds().fillna(0)
+    events['distances'] = calculate_user_distances(events)
+    events['start_time'] = users.timestamp.shift(1)
+    events['stay_start'] = 1*(events.duration >= threshold)
+
+    stay_ids = users.stay_start.cumsum()
+    if events.is_carried.any():
+        # continue the stay IDs of carried users
+        carried_ids = events.stay_id.where(events.is_carried)
+        stay_ids += carried_ids.groupby(events.user_id).transform('first').fillna(0).astype(int)
+    events['stay_id'] = stay_ids
+    return events[~events.is_carried].drop(columns='is_carried').reset_index(drop=True)
+
+
+def stream_user_stays(filepath, threshold=15*60, chunksize=1_000_000, resolution=8, cell_geometry=None,
+                      timezone=None):
+    """
+    Detects user stays from an events file in chunks and yields stays as each chunk is completed.
+    The file must be sorted by user_id and timestamp. The last event and the open stay of the
+    last user in a chunk are carried over to the next chunk, so memory is bounded by the chunk size.
+
+    filepath : CSV or Parquet file with user_id, timestamp, latitude and longitude columns
+    threshold : minimum duration (in seconds) before a record to mark a stay
+    cell_geometry : CellGeometry providing the centres of grid areas (computed in memory if None)
+    timezone : local timezone of time features, e.g. GULF_STANDARD_TIME (times as recorded if None)
+    """
+    if cell_geometry is None:
+        cell_geometry = CellGeometry()
+    last_event = None # last event of the previous chunk
+    open_stay = None # records of the last user's stay that may continue in the next chunk
+
+    for chunk in read_event_chunks(filepath, chunksize):
+        chunk['area'] = assign_cells(chunk.latitude.values, chunk.longitude.values, resolution)[resolution]
+
+        user_ids = chunk.user_id.values
+        if (user_ids[1:] < user_ids[:-1]).any() or (last_event is not None and user_ids[0] < last_event.user_id.iloc[0]):
+            raise ValueError(f'{filepath} must be sorted by user_id and timestamp')
+
+        chunk = continue_user_events(chunk, last_event, threshold)
+        last_event = chunk.iloc[[-1]][LAST_EVENT_COLUMNS]
+
+        records = pd.concat([open_stay, chunk], ignore_index=True) if open_stay is not None else chunk
+        records = records.assign(stay_end = find_stay_ends(records))
+
+        # hold back the last stay of the last user until its end is known
+        is_open = ((records.user_id == records.user_id.iloc[-1]) &
+                   (records.stay_id == records.stay_id.iloc[-1])).values
+        open_stay = records[is_open] if records.stay_id.iloc[-1] > 0 else None
+        finished = records[~is_open]
+
+        if len(finished) > 0:
+            yield _finish_streamed_stays(finished, cell_geometry, timezone)
+
+    if open_stay is not None:
+        yield _finish_streamed_stays(open_stay, cell_geometry, timezone)
+
+
+def _finish_streamed_stays(records, cell_geometry, timezone=None):
+    user_stays = add_stay_features(aggregate_user_stays(records), timezone)
+    return user_stays.merge(cell_geometry.grid_areas(user_stays['area']), on=['area'])
+
+
+# upper speed (km/h, inclusive) of each mode of transport
+TRANSPORT_MODE_BINS = {
+    'Walking' : 5,
+    'Jog|Run' : 15,
+    'Biking' : 30,
+    'Car|Taxi|Train|Bus' : 160,
+    'High Speed Train' : 450
+}
+
+
+def assign_transportation_mode(speeds, mode_bins=TRANSPORT_MODE_BINS):
+    """
+    Assigns a mode of transport of users at stays from their average speeds (km/h)
+    mode_bins : dictionary of mode of transport and its upper speed (in increasing order)
+    Speeds of 0 are Stationary, negative speeds or speeds above the last bin are Anomalous
+    Returns a categorical series
+    """
+    labels = ['Stationary', *mode_bins.keys(), 'Anomalous (Likely Error)']
+    edges = np.array([0, *mode_bins.values()], dtype=float)
+    if (np.diff(edges) <= 0).any():
+        raise ValueError('mode_bins speeds must be positive and increasing')
+
+    speed_values = np.asarray(speeds, dtype=float)
+    # 0 for speed == 0, i for edges[i-1] < speed <= edges[i] and len(edges) above the last edge (or NaN)
+    codes = np.digitize(speed_values, edges, right=True)
+    codes[speed_values < 0] = len(labels) - 1
+
+    transport_modes = pd.Categorical.from_codes(codes, categories=labels)
+    index = speeds.index if isinstance(speeds, pd.Series) else None
+    return pd.Series(transport_modes, index=index, name='transport_mode')